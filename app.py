@@ -4,7 +4,8 @@ import os
 from datetime import datetime
 import random
 import flask
-from flask import Flask, render_template, redirect, request
+from flask import Blueprint, Flask, current_app, render_template, redirect, request
+from sqlalchemy import text
 from flask_login import (
     LoginManager,
     login_required,
@@ -14,54 +15,76 @@ from flask_login import (
 )
 
 from werkzeug.security import generate_password_hash, check_password_hash
-from dotenv import find_dotenv, load_dotenv
-from openweather import get_weather
+
+# reads the .env file, before the modules below read their settings
+from config import Config
+import http_client
+import metrics
 from models import db, Joes, Entry, Task
 from database_functions import (
-    get_entries,
-    delete_Entry,
+    get_entries_page,
+    score_entries,
+    backfill_tones,
+    delete_entries,
     get_task_lists,
-    delete_task_list,
+    delete_task_lists,
+    edit_task_lists,
+    reorder_task_lists,
 )
 
-from fun_fact import fun_fact
-from nyt import nyt_results
+from useful_functions import formation, date_range, DATE_RANGES
+from migrations import upgrade
+from search import index_row, search, SEARCH_PAGE_SIZE
+from journal_io import (
+    export_entries,
+    import_entries,
+    FORMATS,
+    UnreadableFileError,
+)
+from widgets import fetch_widgets, user_providers, WIDGET_MAX_AGE
+from twitter import TREND_REGIONS, DEFAULT_WOEID
+from scheduler import start_scheduler, stop_scheduler
+from user_cache import get_user
+from assets import init_assets, build_image_variants
 
-from twitter import get_trends
-from useful_functions import formation, sort_emotions
-from sentiment import get_emotion
-from nasa import nasa_picture
+# every page and command of the app, added to it by create_app
+main = Blueprint("main", __name__, cli_group=None)
 
+# initializing login feature
+login_manager = LoginManager()
 
-load_dotenv(find_dotenv())
 
-# Create app, configure db
-app = Flask(__name__)
-app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 0
-app.secret_key = os.getenv("SECRET")
-app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgres://"):
-    app.config["SQLALCHEMY_DATABASE_URI"] = app.config[
-        "SQLALCHEMY_DATABASE_URI"
-    ].replace("postgres://", "postgresql://")
+def create_app(config=None):
+    """Builds the app. config overrides the settings read from the
+    environment, e.g. a test database. Nothing here touches the database;
+    run `flask --app app init-db` to create or upgrade the schema."""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if config:
+        app.config.update(config)
 
-db.init_app(app)
-with app.app_context():
-    db.create_all()
+    # every request is timed by its route, see /metrics
+    metrics.init_metrics(app)
 
-# initializing login feature
-login_manager = LoginManager()
-login_manager.init_app(app)
+    db.init_app(app)
+    # static files are linked with a content hash in their name and cached for a year
+    init_assets(app)
+    # timestamps are stored as datetimes and shown the way formation() writes them
+    app.add_template_filter(formation)
+    login_manager.init_app(app)
+    app.register_blueprint(main)
+    if app.config["WIDGET_SCHEDULER"] != "off":
+        app.before_request(start_scheduler)
+    return app
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Loads user ID of user"""
-    return Joes.query.get(int(user_id))
+    """Loads user ID of user, from the per process user cache when it can"""
+    return get_user(user_id)
 
 
-@app.route("/", methods=["GET", "POST"])
+@main.route("/", methods=["GET", "POST"])
 def landing():
     # generate random welcome tags
     tags = ["Top of the morning!", "Take your daily sip.", "Start your day off right."]
@@ -70,7 +93,7 @@ def landing():
 
 
 # route to log a user in
-@app.route("/login", methods=["GET", "POST"])
+@main.route("/login", methods=["GET", "POST"])
 def login():
     """
     Login page of application
@@ -85,13 +108,13 @@ def login():
             user_info = Joes.query.filter_by(email=email).first()
             if check_password_hash(user_info.password, password):
                 login_user(user_info)
-                return flask.redirect(flask.url_for("home"))
+                return flask.redirect(flask.url_for("main.home"))
             # if the user isn't logged in, the password is incorrect
             flask.flash("Password is not correct. Please try again.")
         # if the user does not exist, redirect to signup
         except:
             flask.flash("No user with that email found. Register below!")
-            return flask.redirect(flask.url_for("signup"))
+            return flask.redirect(flask.url_for("main.signup"))
     return render_template(
         "login.html",
     )
@@ -99,7 +122,7 @@ def login():
 
 # route to allow a user to register
 # add auth back later
-@app.route("/signup", methods=["GET", "POST"])
+@main.route("/signup", methods=["GET", "POST"])
 def signup():
     """
     Signup page of application
@@ -120,47 +143,97 @@ def signup():
             db.session.add(register_user)
             db.session.commit()
             flask.flash("You have successfully registered.")
-            return flask.redirect(flask.url_for("login"))
+            return flask.redirect(flask.url_for("main.login"))
         # if it throws an error, some input has conflicted with the rules
         except:
             flask.flash(
                 "Something went wrong. Either that username is taken or \
                 you have left an entry blank. Please try again."
             )
-            return flask.redirect(flask.url_for("signup"))
+            return flask.redirect(flask.url_for("main.signup"))
     return render_template("signup.html")
 
 
 # route to allow user to sign out
-@app.route("/signout")
+@main.route("/signout")
 @login_required
 def signout():
     """Simple signout function using logout_user"""
     logout_user()
     flask.flash("You have successfully logged out.")
-    return flask.redirect(flask.url_for("login"))
+    return flask.redirect(flask.url_for("main.login"))
 
 
 # route to user's home page
-@app.route("/home")
+@main.route("/home")
 @login_required
 def home():
     """
     Home page of application
     """
+    # only the page shell is rendered here, the widgets are loaded by the
+    # page from /widgets/<name> so no upstream can delay the first paint
     return render_template(
         "home.html",
         user=current_user.username,
-        weather_info=get_weather(),
-        fun_fact=fun_fact(),
-        nyt=nyt_results(),
-        twitter_trends=get_trends(),
-        nasa=nasa_picture(),
-        task_lists=get_task_lists(current_user.username),
+        task_lists=get_task_lists(current_user.id),
+        trend_regions=TREND_REGIONS,
+        trends_woeid=current_user.trends_woeid or DEFAULT_WOEID,
     )
 
 
-@app.route("/add_task_list", methods=["GET", "POST"])
+@main.route("/widgets/<name>")
+@login_required
+def widget(name):
+    """One home page widget as json, fetched by the page on its own"""
+    providers = user_providers(current_user)
+    if name not in providers:
+        flask.abort(404)
+    data = fetch_widgets({name: providers[name]})[name]
+    response = flask.jsonify({"name": name, "data": data})
+    if data is None:
+        # let the browser try again on the next visit
+        response.status_code = 503
+        response.headers["Cache-Control"] = "no-store"
+    else:
+        response.headers["Cache-Control"] = f"private, max-age={WIDGET_MAX_AGE}"
+    return response
+
+
+@main.route("/set_location", methods=["POST"])
+@login_required
+def set_location():
+    """Saves where the user is so the weather widget can report from there.
+    Two decimals (about 1km) is plenty for the weather and all we keep."""
+    latitude = request.form.get("lat", type=float)
+    longitude = request.form.get("lon", type=float)
+    if latitude is None or longitude is None:
+        return {"error": "lat and lon are required"}, 400
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return {"error": "lat or lon is out of range"}, 400
+    # current_user is a cached copy, the row itself is what gets saved
+    user = db.session.get(Joes, current_user.id)
+    user.latitude = round(latitude, 2)
+    user.longitude = round(longitude, 2)
+    db.session.commit()
+    return {"lat": user.latitude, "lon": user.longitude}
+
+
+@main.route("/set_trends_region", methods=["POST"])
+@login_required
+def set_trends_region():
+    """Saves which region the twitter widget shows trends for. Only the
+    regions in TREND_REGIONS can be picked."""
+    woeid = request.form.get("woeid", type=int)
+    if woeid not in TREND_REGIONS.values():
+        return {"error": "unknown region"}, 400
+    user = db.session.get(Joes, current_user.id)
+    user.trends_woeid = None if woeid == DEFAULT_WOEID else woeid
+    db.session.commit()
+    return {"woeid": woeid}
+
+
+@main.route("/add_task_list", methods=["GET", "POST"])
 def add_task_list():
     """In this method we will add task to our task list"""
     if flask.request.method == "POST":
@@ -170,54 +243,95 @@ def add_task_list():
             flask.flash(
                 "Sorry could not process that, please keep your task title between 1 and 50 charcters and your task list lower 1500 characters"
             )
-            return flask.redirect(flask.url_for("home"))
+            return flask.redirect(flask.url_for("main.home"))
 
-        task_list_information = Task(
-            title=title, content=content, user=current_user.username
-        )
+        task_list_information = Task(title=title, content=content, user=current_user.id)
         db.session.add(task_list_information)
+        # flush for the new id, so the search index is updated in the same commit
+        db.session.flush()
+        index_row("task", task_list_information)
         db.session.commit()
 
-    return flask.redirect(flask.url_for("home"))
+    return flask.redirect(flask.url_for("main.home"))
 
 
-@app.route("/display_task_lists", methods=["GET", "POST"])
+@main.route("/display_task_lists", methods=["GET", "POST"])
+@login_required
 def display_task_list():
     """In this method we will display task in our task list"""
-    task_lists = get_task_lists(current_user.id)
-
     return render_template(
-        "home.html", task_lists=task_lists, all_task_lists=len(task_lists)
+        "home.html",
+        user=current_user.username,
+        task_lists=get_task_lists(current_user.id),
+        trend_regions=TREND_REGIONS,
+        trends_woeid=current_user.trends_woeid or DEFAULT_WOEID,
     )
 
 
-@app.route("/delete_task_list", methods=["GET", "POST"])
+@main.route("/delete_task_list", methods=["GET", "POST"])
+@login_required
 def delete_task():
     """In this method we will remove task from our task list"""
     if request.method == "POST":
         task_list_id = int(flask.request.form["delete_task_list"])
-        print("The Deleted Task List ID is: ", task_list_id)
         """function located in database_function.py"""
-        delete_task_list(task_list_id)
-    return flask.redirect(flask.url_for("home"))
+        delete_task_lists(current_user.id, [task_list_id])
+    return flask.redirect(flask.url_for("main.home"))
+
+
+@main.route("/delete_task_lists", methods=["POST"])
+@login_required
+def delete_selected_task_lists():
+    """Removes every task list ticked on the home page at once"""
+    deleted = delete_task_lists(current_user.id, request.form.getlist("ids", type=int))
+    flask.flash(f"Deleted {deleted} task lists.")
+    return flask.redirect(flask.url_for("main.home"))
+
+
+@main.route("/edit_task_lists", methods=["POST"])
+@login_required
+def edit_selected_task_lists():
+    """Saves several edited task lists at once, sent as task_edit_<id> fields"""
+    contents = {}
+    for name, content in request.form.items():
+        if not name.startswith("task_edit_"):
+            continue
+        task_list_id = name[len("task_edit_") :]
+        if task_list_id.isdigit():
+            contents[int(task_list_id)] = content
+    if any(len(content) > 1500 for content in contents.values()):
+        flask.flash(
+            "Sorry could not process that, please keep your Tasks lower then 1500 characters"
+        )
+        return flask.redirect(flask.url_for("main.home"))
+    edit_task_lists(current_user.id, contents)
+    return flask.redirect(flask.url_for("main.home"))
 
 
-@app.route("/edit_task/<int:id>", methods=["GET", "POST"])
+@main.route("/reorder_task_lists", methods=["POST"])
+@login_required
+def reorder_selected_task_lists():
+    """Moves task lists into the order of the ids sent, returns the new order"""
+    order = reorder_task_lists(current_user.id, request.form.getlist("ids", type=int))
+    return {"order": order}
+
+
+@main.route("/edit_task/<int:id>", methods=["GET", "POST"])
+@login_required
 def edit_task(id):
     """this function edits a task"""
-    current_task_list = Task.query.filter_by(id=id).all()
+    current_task_list = Task.query.filter_by(id=id, user=current_user.id).all()
 
-    task_to_edit = Task.query.get_or_404(id)
+    task_to_edit = Task.query.filter_by(id=id, user=current_user.id).first_or_404()
     if flask.request.method == "POST":
         # This will make sure that the entry is legal and will fit in our database
         if len(request.form.get("task_edit")) > 1500:
             flask.flash(
                 "Sorry could not process that, please keep your Tasks lower then 1500 characters"
             )
-            return flask.redirect(flask.url_for("home"))
-        task_to_edit.content = request.form.get("task_edit")
+            return flask.redirect(flask.url_for("main.home"))
         try:
-            db.session.commit()
+            edit_task_lists(current_user.id, {id: request.form.get("task_edit")})
             return redirect("/home")
         except:
             return "There was a problem updating that..."
@@ -229,28 +343,55 @@ def edit_task(id):
         )
 
 
-@app.route("/view_entries", methods=["GET", "POST"])
+@main.route("/view_entries", methods=["GET", "POST"])
 @login_required
 def users_entries():
     """When the user enters there entries page, we'll then use this function
-    to display all of their previous entries."""
-    # The following algorithm in the database functions file
-    prev_entries = get_entries(current_user.id)
+    to display their previous entries, one page at a time."""
+    # We'll use possible emotions and sort key, to filter the emotions if requested by the user
+    possible_emotions = ["All", "Bored", "Fearful", "Excited", "Happy", "Sad"]
+    # the filter comes from the form, or from the page links once it is set
+    sort_key = request.form.get("sort_key") or request.args.get("sort_key", "All")
+    before = request.args.get("before", type=int)
+    after = request.args.get("after", type=int)
+    # the date range is kept in every link and form on the page
+    dates = {
+        "range": request.values.get("range", "all"),
+        "start": request.values.get("start", ""),
+        "end": request.values.get("end", ""),
+    }
+    start, end = date_range(dates["range"], dates["start"], dates["end"])
+    # The following algorithm in the database functions file, the emotion
+    # filter runs as an indexed query so only matching entries are loaded
+    prev_entries, newer, older = get_entries_page(
+        current_user.id,
+        current_app.config["ENTRIES_PAGE_SIZE"],
+        before=before,
+        after=after,
+        emotion=None if sort_key == "All" else sort_key,
+        start=start,
+        end=end,
+    )
     # adding tone aspect for each entry
     tones = []
-    if len(prev_entries) == 0:
+    first_page = before is None and after is None
+    unfiltered = sort_key == "All" and dates["range"] == "all"
+    if len(prev_entries) == 0 and first_page and unfiltered:
         flask.flash(
             "Sorry, you have no entries at the moment, please add one at the bottom."
         )
-        return redirect(flask.url_for("home"))
+        return redirect(flask.url_for("main.home"))
+    # tones are stored when an entry is added, only entries the api could
+    # not score at the time are sent to it again
+    unscored = [entry for entry in prev_entries if entry.tones is None]
+    if unscored:
+        try:
+            score_entries(unscored)
+            db.session.commit()
+        except Exception:  # pylint: disable=broad-except
+            db.session.rollback()
     for entry in prev_entries:
-        tones.append(get_emotion(entry))
-    """We'll use possible emotions and sort key, to filter the emotions if requested by the user"""
-    possible_emotions = ["All", "Bored", "Fearful", "Excited", "Happy", "Sad"]
-    sort_key = "All"
-    if request.method == "POST":
-        sort_key = flask.request.form["sort_key"]
-        prev_entries, tones = sort_emotions(prev_entries, sort_key, tones)
+        tones.append(entry.tone_list)
     return render_template(
         "entries.html",
         user_entries=prev_entries,
@@ -258,10 +399,16 @@ def users_entries():
         tones=tones,
         num_tones=len(tones),
         possible_emotions=possible_emotions,
+        sort_key=sort_key,
+        newer=newer,
+        older=older,
+        dates=dates,
+        date_ranges=DATE_RANGES,
     )
 
 
-@app.route("/delete_entry", methods=["GET", "POST"])
+@main.route("/delete_entry", methods=["GET", "POST"])
+@login_required
 def delete_entry():
     """Route to delete an entry in the users journal.
     Here we will call a method that removes the
@@ -271,11 +418,20 @@ def delete_entry():
     if request.method == "POST":
         index = int(flask.request.form["Delete"])
         # The following algorithm in the database functions file
-        delete_Entry(index)
-    return flask.redirect(flask.url_for("users_entries"))
+        delete_entries(current_user.id, [index])
+    return flask.redirect(flask.url_for("main.users_entries"))
 
 
-@app.route("/add_entry", methods=["GET", "POST"])
+@main.route("/delete_entries", methods=["POST"])
+@login_required
+def delete_selected_entries():
+    """Removes every entry ticked on the entries page at once"""
+    deleted = delete_entries(current_user.id, request.form.getlist("ids", type=int))
+    flask.flash(f"Deleted {deleted} entries.")
+    return flask.redirect(flask.url_for("main.users_entries"))
+
+
+@main.route("/add_entry", methods=["GET", "POST"])
 def add():
     """Function to add entry to user journals"""
     # new entry object information
@@ -288,16 +444,160 @@ def add():
         flask.flash(
             "Sorry could not process that, please keep your entry title between 1 and 50 charcters and your content between 1 and 1500 characters"
         )
-        return flask.redirect(flask.url_for("home"))
+        return flask.redirect(flask.url_for("main.home"))
     new_entry = Entry(
-        user=poster, title=title, content=contents, timestamp=formation(datetime.now())
+        user=poster, title=title, content=contents, timestamp=datetime.now()
     )
+    # score the entry once now instead of every time the journal is viewed
+    try:
+        score_entries([new_entry])
+    except Exception:  # pylint: disable=broad-except
+        # the sentiment api is unavailable, the entry is scored when it is viewed
+        pass
     db.session.add(new_entry)
+    # flush for the new id, so the search index is updated in the same commit
+    db.session.flush()
+    index_row("entry", new_entry)
     db.session.commit()
-    return flask.redirect(flask.url_for("users_entries"))
+    return flask.redirect(flask.url_for("main.users_entries"))
+
+
+@main.route("/search")
+@login_required
+def search_journal():
+    """Searches the user's journal entries and task lists, best matches first"""
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    results, has_more = search(current_user.id, query, page, SEARCH_PAGE_SIZE)
+    return render_template(
+        "search.html",
+        query=query,
+        results=results,
+        page=page,
+        has_more=has_more,
+    )
+
+
+@main.route("/export_entries")
+@login_required
+def export_journal():
+    """Downloads the whole journal as JSON lines or CSV. The file is written
+    as it is read from the database, a batch of entries at a time."""
+    file_format = request.args.get("format", "jsonl")
+    if file_format not in FORMATS:
+        flask.abort(404)
+    mimetype, filename = FORMATS[file_format]
+    return flask.Response(
+        flask.stream_with_context(export_entries(current_user.id, file_format)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@main.route("/import_entries", methods=["POST"])
+@login_required
+def import_journal():
+    """Adds the entries of an exported JSON lines or CSV file to the journal"""
+    upload = request.files.get("journal")
+    file_format = (upload.filename or "").rsplit(".", 1)[-1].lower() if upload else ""
+    if file_format not in FORMATS:
+        flask.flash("Please pick a .jsonl or .csv file exported from your journal.")
+        return flask.redirect(flask.url_for("main.users_entries"))
+    try:
+        imported, skipped = import_entries(current_user.id, upload.stream, file_format)
+        message = f"Imported {imported} entries."
+    except UnreadableFileError as error:
+        imported, skipped = error.imported, error.skipped
+        message = (
+            "The file could not be read to the end."
+            f" Imported the {imported} entries before the unreadable part."
+        )
+    if skipped:
+        message += f" Skipped {skipped} that were empty, too long or unreadable."
+    flask.flash(message)
+    return flask.redirect(flask.url_for("main.users_entries"))
+
+
+@main.route("/metrics")
+def metrics_page():
+    """Latency histograms of requests, upstream apis and database queries,
+    added up over every worker, for Prometheus to scrape"""
+    token = current_app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        flask.abort(401)
+    return flask.Response(
+        metrics.render(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def warm_up(app):
+    """Does the one time work of serving a page before the first request
+    does: compiles every template, hashes the static files and checks the
+    database. gunicorn runs it once before forking, so every worker starts
+    with the results."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    for name in os.listdir(app.static_folder):
+        app.extensions["assets"].digest(name)
+    with app.app_context():
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        # connections must not be shared with the forked workers
+        db.engine.dispose()
+
+
+def warm_up_worker(app):
+    """Per worker start up: a fresh database pool and http session, one
+    connection opened ahead of the first request, and the widget refresh
+    thread (threads do not survive the fork)"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    http_client.reset_session(close=False)
+    if app.config["WIDGET_SCHEDULER"] != "off":
+        start_scheduler()
+
+
+def shut_down_worker(app):
+    """Lets a worker finish cleanly: stops the refresh thread and closes the
+    pooled database and http connections"""
+    stop_scheduler()
+    # keep the worker's last numbers for /metrics in the other workers
+    metrics.flush()
+    with app.app_context():
+        db.engine.dispose()
+    http_client.reset_session()
+
+
+@main.cli.command("backfill-tones")
+def backfill_tones_command():
+    """Stores tones for every entry saved before tones were kept in the database"""
+    filled = backfill_tones()
+    print(f"Stored tones for {filled} entries")
+
+
+@main.cli.command("optimize-images")
+def optimize_images_command():
+    """Writes the resized png and webp copies of the images the pages use"""
+    for name in build_image_variants(current_app.static_folder):
+        print(f"Wrote static/{name}")
+
+
+@main.cli.command("init-db")
+def init_db_command():
+    """Creates the tables and adds anything an existing database is missing.
+    Run it once per deploy (the Procfile's release step does), not per process."""
+    upgrade()
+    print("Database is up to date")
+
+
+# the name this command had before it also created the tables
+main.cli.add_command(init_db_command, "upgrade-db")
 
 
 if __name__ == "__main__":
-    app.run(
+    create_app().run(
         host=os.getenv("IP", "0.0.0.0"), port=int(os.getenv("PORT", 8080)), debug=True
     )
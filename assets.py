@@ -0,0 +1,199 @@
+"""Static files with a hash of their content in the name, so browsers can keep
+them for a year and still pick up a new version the moment it is deployed"""
+
+import hashlib
+import io
+import os
+import re
+
+from flask import send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# a year, the longest a browser is asked to keep a file
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+# how many hex digits of the content hash go into the file name
+HASH_LENGTH = 12
+
+# image -> widths of the variants `flask optimize-images` writes next to it,
+# saved as png and webp. None means a webp copy at the original size.
+IMAGE_VARIANTS = {
+    "mug_logo.png": (50, 100),
+    "new_logo.png": (500,),
+    "splash.png": (None,),
+}
+WEBP_QUALITY = 85
+
+_FINGERPRINT = re.compile(
+    r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[^./]+)$" % HASH_LENGTH
+)
+_CSS_URL = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+
+
+class AssetManifest:
+    """Maps file names in the static folder to their fingerprinted names.
+    Hashes are worked out the first time a file is asked for and again only
+    when it changes on disk."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        # file name -> (mtime, size, digest, rewritten css body, css references)
+        self._files = {}
+
+    def _path(self, filename):
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        return path
+
+    def _fresh(self, entry, stat):
+        return (
+            entry is not None
+            and entry[:2] == (stat.st_mtime_ns, stat.st_size)
+            and all(self.digest(name) == digest for name, digest in entry[4])
+        )
+
+    def _entry(self, filename):
+        path = self._path(filename)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        entry = self._files.get(filename)
+        if self._fresh(entry, stat):
+            return entry
+        with open(path, "rb") as source:
+            body = source.read()
+        references = ()
+        if filename.endswith(".css"):
+            # the css points at images by name, so its hash has to cover the
+            # names those images get, or a new image would hide behind old css
+            body, references = self._rewrite_css(filename, body)
+        digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        entry = (
+            stat.st_mtime_ns,
+            stat.st_size,
+            digest,
+            body if references else None,
+            references,
+        )
+        self._files[filename] = entry
+        return entry
+
+    def _rewrite_css(self, filename, body):
+        base = os.path.dirname(filename)
+        references = []
+
+        def replace(match):
+            quote, target = match.groups()
+            if ":" in target or target.startswith(("/", "#")):
+                return match.group(0)
+            name = os.path.normpath(os.path.join(base, target))
+            digest = self.digest(name)
+            if digest is None:
+                return match.group(0)
+            references.append((name, digest))
+            stem, ext = os.path.splitext(target)
+            return f"url({quote}{stem}.{digest}{ext}{quote})"
+
+        body = _CSS_URL.sub(replace, body.decode("utf-8")).encode("utf-8")
+        return body, tuple(references)
+
+    def digest(self, filename):
+        """Content hash of filename, None if there is no such file"""
+        entry = self._entry(filename)
+        return entry[2] if entry else None
+
+    def hashed(self, filename):
+        """home.css -> home.<hash>.css, unknown files are left alone"""
+        digest = self.digest(filename)
+        if digest is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.{digest}{ext}"
+
+    def resolve(self, requested):
+        """Turns a requested name back into (file name, fingerprinted). The
+        second part is False for plain names and for hashes of an older
+        version, which still get the current file but must not be kept."""
+        match = _FINGERPRINT.match(requested)
+        if match:
+            filename = match.group("stem") + match.group("ext")
+            digest = self.digest(filename)
+            if digest is not None:
+                return filename, digest == match.group("digest")
+        return requested, False
+
+    def send(self, filename):
+        """Response for one static file, immutable for a year if the name
+        carries the current hash and revalidated every time otherwise"""
+        filename, fingerprinted = self.resolve(filename)
+        entry = self._entry(filename)
+        if entry is None:
+            raise NotFound()
+        max_age = ASSET_MAX_AGE if fingerprinted else 0
+        if entry[3] is not None:
+            response = send_file(
+                io.BytesIO(entry[3]),
+                mimetype="text/css",
+                etag=entry[2],
+                last_modified=entry[0] / 1e9,
+                max_age=max_age,
+            )
+        else:
+            response = send_file(self._path(filename), etag=entry[2], max_age=max_age)
+        if fingerprinted:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+
+def init_assets(app):
+    """Makes url_for('static', ...) hand out fingerprinted names and serves
+    them with long lived caching"""
+    manifest = AssetManifest(app.static_folder)
+    app.extensions["assets"] = manifest
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = manifest.hashed(values["filename"])
+
+    app.view_functions["static"] = manifest.send
+    return manifest
+
+
+def variant_name(filename, width, ext):
+    """mug_logo.png, 100, .webp -> mug_logo-100w.webp"""
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}-{width}w{ext}" if width else f"{stem}{ext}"
+
+
+def build_image_variants(folder, variants=None):
+    """Writes resized, optimized png and webp copies of the images in
+    IMAGE_VARIANTS and returns the names written. Needs Pillow, which is only
+    used here and so is not in requirements.txt."""
+    try:
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise RuntimeError("pip install pillow to build image variants") from error
+
+    written = []
+    for filename, widths in (variants or IMAGE_VARIANTS).items():
+        with Image.open(os.path.join(folder, filename)) as original:
+            for width in widths:
+                image = original
+                if width and width < original.width:
+                    height = round(original.height * width / original.width)
+                    image = original.resize((width, height), Image.LANCZOS)
+                # at full size the original png is kept and only a webp is added
+                for ext in (".png", ".webp") if width else (".webp",):
+                    name = variant_name(filename, width, ext)
+                    options = (
+                        {"optimize": True}
+                        if ext == ".png"
+                        else {"quality": WEBP_QUALITY, "method": 6}
+                    )
+                    image.save(os.path.join(folder, name), **options)
+                    written.append(name)
+    return written
@@ -0,0 +1,339 @@
+"""Times the app's hot helpers and data paths on their own: filtering entries
+by emotion, turning sentiment scores into tones, formatting dates, reading
+entries and task lists from tables of 10k to 1M rows, and rendering the
+entries and home pages. Save a run as the baseline, and later runs can be
+compared against it to catch a path that got slower.
+
+    python benchmark.py --save                 # run, keep as the baseline
+    python benchmark.py --compare              # exit 1 if a path regressed
+    python benchmark.py --rows 10000,1000000 --only get_entries
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "benchmark_baseline.json")
+
+# a path regresses when it is this much slower than the baseline
+DEFAULT_THRESHOLD = 0.25
+# the rows of the entry, tone and task tables are spread over this many users
+USERS = 100
+# entries and task lists shown on one page
+PAGE_SIZE = 20
+EMOTIONS = ["Happy", "Sad", "Fearful", "Excited", "Bored", "Angry"]
+WORDS = """happy tired coffee work friends rain sunny walk dinner family
+    excited nervous meeting gym lonely proud book movie trip grateful""".split()
+
+
+def measure(func, min_time=0.2, repeats=5):
+    """(best, median) seconds per call of func. Each repeat calls it in a
+    loop long enough to time reliably, the best repeat is the one least
+    disturbed by the rest of the machine."""
+
+    def time_loops(loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        return time.perf_counter() - start
+
+    loops = 1
+    elapsed = time_loops(loops)
+    while elapsed < min_time:
+        # aim for min_time straight away once a run is long enough to scale
+        loops = max(loops * 2, int(loops * min_time * 1.1 / max(elapsed, 1e-9)))
+        elapsed = time_loops(loops)
+    times = [elapsed / loops]
+    times.extend(time_loops(loops) / loops for _ in range(repeats - 1))
+    return min(times), statistics.median(times)
+
+
+def fake_scores(rng):
+    """Emotion scores shaped like the sentiment api's"""
+    scores = {emotion.replace("Fearful", "Fear"): rng.random() for emotion in EMOTIONS}
+    total = sum(scores.values())
+    return {emotion: score / total for emotion, score in scores.items()}
+
+
+def helper_cases(app):
+    """name -> callable for the helpers that do not touch the database"""
+    # pylint: disable=import-outside-toplevel
+    from flask import render_template
+    from models import Entry, Task
+    from sentiment import tones_from_scores
+    from twitter import TREND_REGIONS, DEFAULT_WOEID
+    from useful_functions import DATE_RANGES, formation, sort_emotions
+
+    rng = random.Random(0)
+    now = datetime(2022, 4, 15, 8, 30)
+    tones = [rng.sample(EMOTIONS, rng.randint(1, 2)) for _ in range(10000)]
+    entries = list(range(len(tones)))
+    scores = [fake_scores(rng) for _ in range(1000)]
+    dates = [now - timedelta(hours=n) for n in range(1000)]
+    page = [
+        Entry(
+            id=1000 - n,
+            user=1,
+            title=f"Day {n}",
+            content=" ".join(rng.choices(WORDS, k=150)),
+            timestamp=now - timedelta(days=n),
+        )
+        for n in range(PAGE_SIZE)
+    ]
+    task_lists = [
+        Task(id=n, user=1, title=f"List {n}", content="milk, eggs, bread, coffee")
+        for n in range(PAGE_SIZE)
+    ]
+
+    def render_entries():
+        with app.test_request_context("/view_entries"):
+            render_template(
+                "entries.html",
+                user_entries=page,
+                length=len(page),
+                tones=tones[: len(page)],
+                num_tones=len(page),
+                possible_emotions=["All"] + EMOTIONS[:5],
+                sort_key="All",
+                newer=None,
+                older=page[-1].id,
+                dates={},
+                date_ranges=DATE_RANGES,
+            )
+
+    def render_home():
+        with app.test_request_context("/home"):
+            render_template(
+                "home.html",
+                user="sam",
+                task_lists=task_lists,
+                trend_regions=TREND_REGIONS,
+                trends_woeid=DEFAULT_WOEID,
+            )
+
+    return {
+        "sort_emotions 10k entries": lambda: sort_emotions(entries, "Happy", tones),
+        "tones_from_scores x1000": lambda: [tones_from_scores(s) for s in scores],
+        "formation x1000": lambda: [formation(date) for date in dates],
+        f"render entries.html {PAGE_SIZE} entries": render_entries,
+        f"render home.html {PAGE_SIZE} task lists": render_home,
+    }
+
+
+def seed(rows, chunk=50000):
+    """Fills the entry, tone and task tables with rows rows each, spread
+    over USERS users, newest entries with the highest ids"""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import insert
+    from models import db, Joes, Entry, EntryTone, Task
+
+    rng = random.Random(0)
+    db.session.execute(
+        insert(Joes),
+        [
+            {
+                "id": n,
+                "email": f"u{n}@example.com",
+                "username": f"u{n}",
+                "password": "x",
+            }
+            for n in range(1, USERS + 1)
+        ],
+    )
+    start = datetime(2022, 4, 15) - timedelta(hours=rows)
+    for first in range(1, rows + 1, chunk):
+        entries, entry_tones, tasks = [], [], []
+        for entry_id in range(first, min(first + chunk, rows + 1)):
+            user = entry_id % USERS + 1
+            tones = rng.sample(EMOTIONS, rng.randint(1, 2))
+            entries.append(
+                {
+                    "id": entry_id,
+                    "user": user,
+                    "title": f"Day {entry_id}",
+                    "content": " ".join(rng.choices(WORDS, k=30)),
+                    "timestamp": start + timedelta(hours=entry_id),
+                    "tones": ",".join(tones),
+                }
+            )
+            entry_tones.extend(
+                {"entry_id": entry_id, "emotion": tone, "user": user} for tone in tones
+            )
+            tasks.append(
+                {"id": entry_id, "user": user, "title": "List", "content": "milk, eggs"}
+            )
+        db.session.execute(insert(Entry), entries)
+        db.session.execute(insert(EntryTone), entry_tones)
+        db.session.execute(insert(Task), tasks)
+    db.session.commit()
+
+
+def data_cases(rows):
+    """name -> callable reading one user's entries and task lists from tables
+    of rows rows. Each call ends its session the way a request does, so
+    nothing is served from the previous call's objects."""
+    # pylint: disable=import-outside-toplevel
+    from database_functions import get_entries, get_entries_page, get_task_lists
+    from models import db
+
+    user = 1
+    # a cursor half way through the user's journal
+    middle = rows // 2 - rows // 2 % USERS
+    since = datetime(2022, 4, 15) - timedelta(hours=rows // 4)
+
+    def session_per_call(func):
+        def call():
+            func()
+            db.session.remove()
+
+        return call
+
+    label = f"{rows // 1000}k rows" if rows < 1000000 else f"{rows // 1000000}M rows"
+    cases = {
+        "get_entries_page first": lambda: get_entries_page(user, PAGE_SIZE),
+        "get_entries_page deep": lambda: get_entries_page(
+            user, PAGE_SIZE, before=middle
+        ),
+        "get_entries_page emotion": lambda: get_entries_page(
+            user, PAGE_SIZE, emotion="Happy"
+        ),
+        "get_entries_page date range": lambda: get_entries_page(
+            user, PAGE_SIZE, start=since
+        ),
+        "get_entries whole journal": lambda: get_entries(user),
+        "get_task_lists": lambda: get_task_lists(user),
+    }
+    return {f"{name} [{label}]": session_per_call(func) for name, func in cases.items()}
+
+
+def make_app(database_url):
+    # pylint: disable=import-outside-toplevel
+    from app import create_app
+
+    return create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": database_url,
+            "SECRET_KEY": "benchmark",
+            "WIDGET_SCHEDULER": "off",
+        }
+    )
+
+
+def run(sizes, only=None, min_time=0.2, repeats=5):
+    """{name: {"best": seconds, "median": seconds}} of every benchmark whose
+    name contains only, printed as they finish"""
+    # pylint: disable=import-outside-toplevel
+    from migrations import upgrade
+    from models import db
+
+    results = {}
+
+    def time_cases(cases):
+        for name, func in cases.items():
+            if only and only not in name:
+                continue
+            best, median = measure(func, min_time, repeats)
+            results[name] = {"best": best, "median": median}
+            print(f"  {name:48} {best * 1e6:12.1f} us  (median {median * 1e6:.1f})")
+
+    app = make_app("sqlite://")
+    time_cases(helper_cases(app))
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as folder:
+        for rows in sizes:
+            cases = data_cases(rows)
+            if only and not any(only in name for name in cases):
+                continue
+            path = os.path.join(folder, f"{rows}.db")
+            app = make_app(f"sqlite:///{path}")
+            with app.app_context():
+                upgrade()
+                print(f"  seeding {rows} rows")
+                seed(rows)
+                time_cases(cases)
+                db.session.remove()
+                db.engine.dispose()
+    return results
+
+
+def compare(baseline, results, threshold):
+    """(name, baseline seconds, seconds, change) of every benchmark in both,
+    and the names of the ones more than threshold slower than the baseline"""
+    rows, regressions = [], []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["best"], result["best"]
+        change = after / before - 1
+        rows.append((name, before, after, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--rows",
+        default="10000,100000",
+        help="comma separated table sizes for the data paths, e.g. 10000,1000000",
+    )
+    parser.add_argument("--only", help="run the benchmarks whose name contains this")
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="seconds per repeat"
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE, help="baseline json file")
+    parser.add_argument("--save", action="store_true", help="save as the baseline")
+    parser.add_argument(
+        "--compare", action="store_true", help="exit 1 when slower than the baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="allowed slowdown before failing, 0.25 is 25%% (default)",
+    )
+    args = parser.parse_args()
+
+    sizes = [int(rows) for rows in args.rows.split(",")]
+    results = run(sizes, args.only, args.min_time, args.repeats)
+
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        rows, regressions = compare(baseline, results, args.threshold)
+        print(f"compared with {args.baseline}, best time per call")
+        for name, before, after, change in rows:
+            mark = "  REGRESSED" if name in regressions else ""
+            print(
+                f"  {name:48} {before * 1e6:12.1f} -> {after * 1e6:12.1f} us"
+                f" {change:+7.1%}{mark}"
+            )
+        if regressions:
+            print(
+                f"{len(regressions)} of {len(rows)} paths are over {args.threshold:.0%} slower"
+            )
+            sys.exit(1)
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(
+                {"python": sys.version.split()[0], "results": results},
+                file,
+                indent=2,
+                sort_keys=True,
+            )
+        print(f"saved the baseline to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
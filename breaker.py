@@ -0,0 +1,99 @@
+"""Stops calling an upstream api for a while once it keeps failing, so a
+provider that is down or slow answers at once instead of tying up a worker
+until its timeouts run out"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# failures (errors or calls slower than the slow limit) in a row that open
+# the circuit, and seconds it stays open before one probe call is let through
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "3"))
+CIRCUIT_RESET = float(os.getenv("CIRCUIT_RESET", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Counts the failures of one upstream in a row.
+
+    Closed, every call goes through. After `failures` failures in a row the
+    circuit opens and calls fail with CircuitOpenError without being made.
+    Once `reset` seconds have passed it is half-open: a single probe call is
+    made, closing the circuit again when it works and opening it for another
+    `reset` seconds when it does not. A call slower than `slow` seconds
+    counts as a failure even when it returns, since the page stopped waiting
+    for it long before."""
+
+    def __init__(
+        self,
+        name,
+        failures=CIRCUIT_FAILURES,
+        reset=CIRCUIT_RESET,
+        slow=None,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.slow = slow
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failed = 0
+        self._opened_at = 0
+        self._probing = False
+
+    def _allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self._clock() - self._opened_at >= self.reset:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def _record(self, ok):
+        with self._lock:
+            probe, self._probing = self._probing, False
+            if ok:
+                if self.state != CLOSED:
+                    logger.info("The %s circuit is closed again", self.name)
+                self.state = CLOSED
+                self._failed = 0
+                return
+            self._failed += 1
+            if probe or self._failed >= self.failures:
+                if self.state != OPEN:
+                    logger.warning(
+                        "The %s circuit is open for %ss after %s failures",
+                        self.name,
+                        self.reset,
+                        self._failed,
+                    )
+                self.state = OPEN
+                self._opened_at = self._clock()
+
+    def call(self, func, *args, **kwargs):
+        """Calls func unless the circuit is open"""
+        if not self._allow():
+            raise CircuitOpenError(f"{self.name} is unavailable")
+        start = self._clock()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._record(False)
+            raise
+        self._record(self.slow is None or self._clock() - start <= self.slow)
+        return result
@@ -0,0 +1,125 @@
+"""Keeps a shared copy of widget data that is the same for every user"""
+
+import threading
+import time
+
+
+class _Call:
+    """One in-flight load of a key that other requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ProviderCache:
+    """A small in-process TTL cache for provider results.
+
+    Fresh values are returned as they are. Once a value is older than its
+    ttl it is still served for up to `max_stale` more seconds while a single
+    background refresh replaces it. A cold or expired key is loaded once no
+    matter how many requests ask for it at the same time; the rest wait for
+    that one upstream call."""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (value, fetched_at)
+        self._entries = {}
+        # key -> _Call for loads that are currently running
+        self._inflight = {}
+        # key -> when it was last invalidated
+        self._invalidated = {}
+
+    def get(self, key, loader, ttl, max_stale=0):
+        """Returns the cached value for key, calling loader when needed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = self._clock() - fetched_at
+                if age < ttl:
+                    return value
+                if age < ttl + max_stale:
+                    # serve the stale copy now and refresh it behind the scenes
+                    if key not in self._inflight:
+                        call = self._inflight[key] = _Call()
+                        threading.Thread(
+                            target=self._load,
+                            args=(key, loader, call),
+                            name=f"cache-refresh-{key}",
+                            daemon=True,
+                        ).start()
+                    return value
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if leader:
+            self._load(key, loader, call)
+        else:
+            call.done.wait()
+        if call.error is not None:
+            # a failed refresh still leaves the last good value usable
+            if entry is not None:
+                return entry[0]
+            raise call.error
+        return call.value
+
+    def put(self, key, value, fetched_at=None):
+        """Stores a value that was fetched somewhere else"""
+        if fetched_at is None:
+            fetched_at = self._clock()
+        with self._lock:
+            if fetched_at < self._invalidated.get(key, fetched_at):
+                # loaded before the value was invalidated, so it may be outdated
+                return
+            current = self._entries.get(key)
+            if current is None or current[1] <= fetched_at:
+                self._entries[key] = (value, fetched_at)
+
+    def peek(self, key):
+        """Returns (value, fetched_at) for key, or None when it was never loaded"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def invalidate(self, key):
+        """Forgets key so the next read loads it again. A load that was
+        already running when this was called is not stored."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._clock()
+
+    def clear(self):
+        """Forgets every cached value"""
+        with self._lock:
+            self._entries.clear()
+
+    def wrap(self, key, loader, ttl, max_stale=0):
+        """Returns a no-argument function that reads loader through the cache"""
+
+        def cached_loader():
+            return self.get(key, loader, ttl, max_stale)
+
+        # lets a caller that gave up on it still find the last value
+        cached_loader.cache_key = key
+        return cached_loader
+
+    def _load(self, key, loader, call):
+        """Runs loader once and hands the result to everyone waiting on it"""
+        started = self._clock()
+        try:
+            call.value = loader()
+            self.put(key, call.value, started)
+        except Exception as error:  # pylint: disable=broad-except
+            call.error = error
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+
+# one cache per process shared by every request
+widget_cache = ProviderCache()
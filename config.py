@@ -0,0 +1,32 @@
+"""Settings for the app. The .env file is read here, once, and app.py imports
+this module before any other of ours so their settings see it too."""
+
+import os
+
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+
+def database_url():
+    """DATABASE_URL, with heroku's postgres:// spelled the way SQLAlchemy wants"""
+    url = os.getenv("DATABASE_URL", "")
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+class Config:  # pylint: disable=too-few-public-methods
+    """Flask settings read from the environment, see create_app"""
+
+    SECRET_KEY = os.getenv("SECRET")
+    SQLALCHEMY_DATABASE_URI = database_url()
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # how many journal entries /view_entries shows at a time
+    ENTRIES_PAGE_SIZE = int(os.getenv("ENTRIES_PAGE_SIZE", "20"))
+    # keep the shared widgets refreshed in the background so /home never
+    # waits on an upstream; "off" relies on the cache alone. The thread is
+    # started by the first request a process serves, never by cli commands.
+    WIDGET_SCHEDULER = os.getenv("WIDGET_SCHEDULER", "on")
+    # when set, /metrics is only shown with an "Authorization: Bearer <token>" header
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
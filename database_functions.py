@@ -2,39 +2,221 @@ from models import db, Joes, Entry, Task
 
 # pylint: disable=no-member
 """Functions to display and delete entries from user journals"""
-from models import db, Entry
+import json
+from sqlalchemy import case, delete, func, select, tuple_, update
+from models import db, Entry, EntryTone
+from sentiment import analyze_batch
+from search import index_rows, remove_rows
+from metrics import timed, QUERY_SECONDS
 
 
-def get_entries(user_id):
-    """Function to display entries from user's journal"""
-    entries = Entry.query.filter_by(user=user_id).all()
-    return entries
+@timed(QUERY_SECONDS, "get_entries")
+def get_entries(
+    user_id, before=None, after=None, limit=None, emotion=None, start=None, end=None
+):
+    """Function to display entries from user's journal, newest first.
+    before/after are entry ids to page from, so a page is found through the
+    (user, id) index no matter how many entries come before it. With an
+    emotion only the entries with that tone are returned, found through the
+    (user, emotion, entry_id) index of the tone table. start/end narrow the
+    entries to when they were written; the entries are then ordered and
+    paged by (timestamp, id), a range scan of the (user, timestamp) index."""
+    if emotion is None:
+        query = Entry.query.filter_by(user=user_id)
+        id_column = Entry.id
+    else:
+        query = Entry.query.join(EntryTone, EntryTone.entry_id == Entry.id).filter(
+            EntryTone.user == user_id, EntryTone.emotion == emotion
+        )
+        id_column = EntryTone.entry_id
+    order = [id_column]
+    if start is not None or end is not None:
+        if emotion is not None:
+            # so the entries can be found through (user, timestamp) too
+            query = query.filter(Entry.user == user_id)
+        if start is not None:
+            query = query.filter(Entry.timestamp >= start)
+        if end is not None:
+            query = query.filter(Entry.timestamp < end)
+        # the id breaks ties between entries written at the same moment
+        order = [Entry.timestamp, Entry.id]
 
+    def past(entry_id, newer):
+        """The entries newer (or older) than the cursor entry in that order,
+        the cursor's timestamp looked up in the same query"""
+        key, cursor = order[0], entry_id
+        if len(order) > 1:
+            timestamp = select(Entry.timestamp).where(Entry.id == entry_id)
+            key = tuple_(*order)
+            cursor = tuple_(timestamp.scalar_subquery(), entry_id)
+        return key > cursor if newer else key < cursor
+
+    if after is not None:
+        # walk forward from the cursor, then flip so the page is newest first
+        query = query.filter(past(after, newer=True)).order_by(
+            *[column.asc() for column in order]
+        )
+        entries = query.limit(limit).all() if limit else query.all()
+        entries.reverse()
+        return entries
+    if before is not None:
+        query = query.filter(past(before, newer=False))
+    query = query.order_by(*[column.desc() for column in order])
+    return query.limit(limit).all() if limit else query.all()
+
+
+def get_entries_page(user_id, page_size, before=None, after=None, **filters):
+    """One page of a user's journal. Returns (entries, newer, older) where
+    newer/older are the cursors for the neighbouring pages, or None when
+    there is no such page. filters are passed on to get_entries."""
+    # one extra row tells us whether there is another page past this one
+    entries = get_entries(
+        user_id, before=before, after=after, limit=page_size + 1, **filters
+    )
+    more = len(entries) > page_size
+    if after is not None:
+        entries = entries[-page_size:] if more else entries
+        newer = entries[0].id if more and entries else None
+        older = entries[-1].id if entries else None
+    else:
+        entries = entries[:page_size]
+        newer = entries[0].id if before is not None and entries else None
+        older = entries[-1].id if more else None
+    return entries, newer, older
 
-def delete_Entry(entry_id):
-    """Function to delete entry from user journal"""
-    entry = Entry.query.filter_by(id=entry_id).first()
-    if entry:
-        db.session.delete(entry)
-        db.session.commit()
 
+def score_entries(entries):
+    """Runs sentiment analysis on the entries in batches and keeps the scores
+    and tones on each one, so they are stored when the caller commits"""
+    results = analyze_batch([entry.content for entry in entries])
+    for entry, (scores, tones) in zip(entries, results):
+        entry.emotion_scores = json.dumps(scores)
+        entry.tones = ",".join(tones)
+        entry.tone_rows = [
+            EntryTone(emotion=tone, user=entry.user) for tone in dict.fromkeys(tones)
+        ]
 
-def delete_task_list(task_list_id):
-    """function to delete task list from database"""
-    task_list = Task.query.filter_by(id=task_list_id).first()
-    if task_list:
-        db.session.delete(task_list)
+
+def backfill_tones(batch_size=100):
+    """Scores every entry that was saved before tones were stored, one
+    committed batch at a time. Returns how many entries were filled in."""
+    filled = 0
+    last_id = 0
+    while True:
+        batch = (
+            Entry.query.filter(Entry.tones.is_(None), Entry.id > last_id)
+            .order_by(Entry.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return filled
+        score_entries(batch)
         db.session.commit()
+        filled += len(batch)
+        last_id = batch[-1].id
 
 
-def get_task_lists(username):
-    """function to get tasklists from database by user ID"""
-    tasks = Task.query.filter_by(user=username).all()
-    return tasks
-    """
-    task_lists = Task.query.filter_by(id=user_id).all()
-    print(task_lists)
-    return task_lists
-    """
-    tasks = Task.query.filter_by(user=username).all()
+@timed(QUERY_SECONDS, "delete_entries")
+def delete_entries(user_id, entry_ids):
+    """Deletes the user's entries with these ids in one transaction, one
+    statement per table however many there are. Ids of entries that are
+    not the user's are left alone. Returns how many were deleted."""
+    entry_ids = list(entry_ids)
+    if not entry_ids:
+        return 0
+    deleted = db.session.scalars(
+        delete(Entry)
+        .where(Entry.user == user_id, Entry.id.in_(entry_ids))
+        .returning(Entry.id)
+    ).all()
+    if deleted:
+        # sqlite does not cascade the delete to the tones unless foreign keys
+        # are switched on, and a later entry can be given the same id
+        db.session.execute(delete(EntryTone).where(EntryTone.entry_id.in_(deleted)))
+        remove_rows("entry", deleted)
+    db.session.commit()
+    return len(deleted)
+
+
+@timed(QUERY_SECONDS, "delete_task_lists")
+def delete_task_lists(user_id, task_list_ids):
+    """Deletes the user's task lists with these ids in one transaction.
+    Returns how many were deleted."""
+    task_list_ids = list(task_list_ids)
+    if not task_list_ids:
+        return 0
+    deleted = db.session.scalars(
+        delete(Task)
+        .where(Task.user == user_id, Task.id.in_(task_list_ids))
+        .returning(Task.id)
+    ).all()
+    remove_rows("task", deleted)
+    db.session.commit()
+    return len(deleted)
+
+
+@timed(QUERY_SECONDS, "edit_task_lists")
+def edit_task_lists(user_id, contents):
+    """Replaces the content of the user's task lists, contents maps task list
+    id -> new content. One update for all of them and the search index
+    updated in the same transaction. Returns how many were changed."""
+    if not contents:
+        return 0
+    # the changed rows come back from the update itself for the search index
+    edited = db.session.execute(
+        update(Task)
+        .where(Task.user == user_id, Task.id.in_(list(contents)))
+        .values(content=case(contents, value=Task.id))
+        .returning(Task.id, Task.user, Task.title, Task.content)
+    ).all()
+    index_rows("task", edited)
+    db.session.commit()
+    return len(edited)
+
+
+@timed(QUERY_SECONDS, "reorder_task_lists")
+def reorder_task_lists(user_id, task_list_ids):
+    """Puts the user's task lists with these ids in the given order, in the
+    places those lists take up now, with one update. Lists not named keep
+    their place. Returns the ids in their new order."""
+    task_list_ids = list(dict.fromkeys(task_list_ids))
+    if not task_list_ids:
+        return []
+    place = func.coalesce(Task.position, Task.id)
+    wanted = case(
+        {task_id: index for index, task_id in enumerate(task_list_ids)},
+        value=Task.id,
+    )
+    # the n-th list in the new order takes the n-th smallest place of the
+    # lists named, both ranked in the same statement as the update
+    ranked = select(
+        Task.id,
+        place.label("place"),
+        func.row_number().over(order_by=(place, Task.id)).label("place_rank"),
+        func.row_number().over(order_by=wanted).label("order_rank"),
+    ).where(Task.user == user_id, Task.id.in_(task_list_ids))
+    moved = ranked.subquery("moved")
+    places = ranked.subquery("places")
+    reordered = set(
+        db.session.scalars(
+            update(Task)
+            .where(Task.id == moved.c.id, moved.c.order_rank == places.c.place_rank)
+            .values(position=places.c.place)
+            .returning(Task.id)
+        )
+    )
+    db.session.commit()
+    return [task_id for task_id in task_list_ids if task_id in reordered]
+
+
+@timed(QUERY_SECONDS, "get_task_lists")
+def get_task_lists(user_id):
+    """function to get tasklists from database by user ID, found through the
+    (user, id) index, in the order the user put them"""
+    tasks = (
+        Task.query.filter_by(user=user_id)
+        .order_by(func.coalesce(Task.position, Task.id), Task.id)
+        .all()
+    )
     return tasks
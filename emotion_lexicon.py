@@ -0,0 +1,78 @@
+"""Offline emotion scoring with a small word list, used when the sentiment
+api should not (or can not) be called"""
+
+import re
+
+import numpy as np
+
+# the same emotions the sentiment api returns
+EMOTIONS = ["Happy", "Sad", "Angry", "Fear", "Excited", "Bored"]
+
+LEXICON = {
+    "Happy": """happy glad joy joyful love loved loving great good wonderful
+        grateful thankful proud smile smiled laugh laughed fun nice peaceful
+        relaxed calm blessed content awesome amazing best enjoyed enjoy""".split(),
+    "Sad": """sad unhappy cry cried crying tears lonely alone miss missed lost
+        loss grief hurt heartbroken depressed upset sorry worst disappointed
+        regret gloomy miserable funeral""".split(),
+    "Angry": """angry mad furious annoyed annoying irritated hate hated rage
+        frustrated frustrating unfair yelled yelling fight argued argument
+        pissed outraged""".split(),
+    "Fear": """afraid scared fear fearful anxious anxiety worried worry nervous
+        panic terrified dread nightmare stressed stress frightened uneasy
+        unsafe danger""".split(),
+    "Excited": """excited exciting thrilled finally trip party adventure eager
+        pumped celebrate celebrated surprise wow incredible vacation
+        countdown""".split(),
+    "Bored": """bored boring tired dull meh nothing usual routine sleepy lazy
+        slow ordinary tedious""".split(),
+}
+
+# weight given to Bored for a text with no matching words, so it reads as
+# neutral instead of picking an emotion at random. It is left out once any
+# word matches, or a single word would have Bored tagged along with it.
+NEUTRAL_PRIOR = 1.0
+
+_TOKEN = re.compile(r"[a-z]+")
+
+# word -> row of the lexicon matrix, and the (words x emotions) matrix itself
+VOCABULARY = {}
+for _emotion in EMOTIONS:
+    for _word in LEXICON[_emotion]:
+        VOCABULARY.setdefault(_word, len(VOCABULARY))
+LEXICON_MATRIX = np.zeros((len(VOCABULARY), len(EMOTIONS)))
+for _column, _emotion in enumerate(EMOTIONS):
+    for _word in LEXICON[_emotion]:
+        LEXICON_MATRIX[VOCABULARY[_word], _column] = 1.0
+PRIOR = np.zeros(len(EMOTIONS))
+PRIOR[EMOTIONS.index("Bored")] = NEUTRAL_PRIOR
+
+
+def score_texts(texts):
+    """Scores every text at once. Returns a list of {emotion: score} dicts
+    that sum to 1, like the api, and an array with how many lexicon words
+    each text matched."""
+    rows = []
+    columns = []
+    for row, text in enumerate(texts):
+        for token in _TOKEN.findall(text.lower().replace("'", "")):
+            column = VOCABULARY.get(token)
+            if column is not None:
+                rows.append(row)
+                columns.append(column)
+
+    # (texts x words) counts, built in one go instead of one text at a time
+    counts = np.bincount(
+        np.asarray(rows, dtype=np.int64) * len(VOCABULARY)
+        + np.asarray(columns, dtype=np.int64),
+        minlength=len(texts) * len(VOCABULARY),
+    ).reshape(len(texts), len(VOCABULARY))
+    raw = counts @ LEXICON_MATRIX
+    raw[raw.sum(axis=1) == 0] = PRIOR
+    scores = raw / raw.sum(axis=1, keepdims=True)
+
+    results = [
+        {emotion: round(float(value), 3) for emotion, value in zip(EMOTIONS, row)}
+        for row in scores
+    ]
+    return results, counts.sum(axis=1)
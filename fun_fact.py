@@ -1,9 +1,10 @@
 """Fun Fact API retreives fun facts from host"""
-import requests
+import http_client
+from metrics import timed, UPSTREAM_SECONDS
 
 
+@timed(UPSTREAM_SECONDS, "fun_fact")
 def fun_fact():
     """Displays a random fun fact"""
-    responses = requests.get("https://api.aakhilv.me/fun/facts")
-    responses_json = responses.json()
+    responses_json = http_client.get_json("https://api.aakhilv.me/fun/facts")
     return responses_json[0]
@@ -0,0 +1,61 @@
+"""Production settings, used by `gunicorn "app:create_app()"` (see the Procfile).
+`python app.py` still runs the flask development server."""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# worker processes, and threads in each of them for requests that wait on io
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread" if threads > 1 else "sync"
+# load the app once in the master so workers fork with it already imported
+# and warmed up, instead of each worker paying for it again
+preload_app = True
+# seconds a silent worker is given before it is restarted, and how long
+# workers get to finish the requests they have after a SIGTERM
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# restart a worker after this many requests to cap slow leaks, 0 never does
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+# workers write their request timings here so /metrics can add them all up,
+# one folder per server so two servers on a machine don't mix
+os.environ.setdefault(
+    "METRICS_DIR",
+    os.path.join(tempfile.gettempdir(), f"my-daily-cup-metrics-{os.getpid()}"),
+)
+
+
+def on_starting(server):
+    """Runs in the master once the app is preloaded, before any fork"""
+    # pylint: disable=import-outside-toplevel
+    from app import warm_up
+    from metrics import clear_dir
+
+    clear_dir(os.environ["METRICS_DIR"])
+    warm_up(server.app.wsgi())
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Runs in each new worker before it takes requests"""
+    from app import warm_up_worker  # pylint: disable=import-outside-toplevel
+
+    warm_up_worker(server.app.wsgi())
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Runs in each worker as it shuts down"""
+    from app import shut_down_worker  # pylint: disable=import-outside-toplevel
+
+    shut_down_worker(server.app.wsgi())
+
+
+def on_exit(server):  # pylint: disable=unused-argument
+    """Runs in the master as the server stops"""
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
@@ -0,0 +1,85 @@
+"""One shared HTTP session for every upstream api, so connections are kept
+alive between calls and no request can hang forever"""
+
+import os
+import random
+import threading
+
+# (connect, read) timeout in seconds for every upstream call
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+# how many times a failed call is tried again before giving up
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+# how many hosts keep a connection pool and how many connections each pool holds
+POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "10"))
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+
+def build_session():
+    """Creates a session with pooled keep-alive connections and bounded retries"""
+    # requests and urllib3 are slow to import, so they are loaded when the
+    # first upstream call is made instead of when the app starts
+    # pylint: disable=import-outside-toplevel
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class JitteredRetry(Retry):
+        """Retry that sleeps a random time up to the exponential backoff, so
+        workers that failed together do not all retry at the same moment"""
+
+        def get_backoff_time(self):
+            backoff = super().get_backoff_time()
+            return random.uniform(0, backoff) if backoff else 0
+
+    retry = JitteredRetry(
+        total=HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=retry
+    )
+    new_session = requests.Session()
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    return new_session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """The shared session, built on first use"""
+    global _session  # pylint: disable=global-statement
+    with _session_lock:
+        if _session is None:
+            _session = build_session()
+        return _session
+
+
+def reset_session(close=True):
+    """Drops the shared session so the next call builds a new one. A freshly
+    forked worker passes close=False, its connections belong to the parent."""
+    global _session  # pylint: disable=global-statement
+    with _session_lock:
+        old, _session = _session, None
+    if old is not None and close:
+        old.close()
+
+
+def get(url, params=None, timeout=None, **kwargs):
+    """GETs url through the shared session with the default timeouts"""
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return get_session().get(url, params=params, timeout=timeout, **kwargs)
+
+
+def get_json(url, params=None, **kwargs):
+    """GETs url and returns the decoded json body, raising on an error status"""
+    response = get(url, params=params, **kwargs)
+    response.raise_for_status()
+    return response.json()
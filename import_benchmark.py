@@ -0,0 +1,94 @@
+"""Measures how long a fresh process takes to import the app and build it,
+the time every new worker and every test run pays before doing anything.
+
+    python import_benchmark.py [--runs 10] [--top 10]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# runs in a fresh interpreter each time so nothing is already imported
+PROBE = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+if hasattr(app, "create_app"):
+    app.create_app()
+built = time.perf_counter()
+print(imported - start, built - imported)
+"""
+
+
+def probe_env():
+    """Environment for the probe: a throwaway database, no background thread"""
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("SECRET", "benchmark")
+    env["WIDGET_SCHEDULER"] = "off"
+    return env
+
+
+def time_startup(runs):
+    """(import seconds, build seconds) of each run"""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=HERE,
+            env=probe_env(),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        results.append((float(output[-2]), float(output[-1])))
+    return results
+
+
+def slowest_imports(top):
+    """The top-level modules that took longest to import, from -X importtime"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=HERE,
+        env=probe_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _self, cumulative, name = line[len("import time:") :].split("|")
+        # two spaces of indent are modules imported directly by app
+        if name.startswith("   ") and not name.startswith("    "):
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    results = time_startup(args.runs)
+    imports = [result[0] * 1000 for result in results]
+    builds = [result[1] * 1000 for result in results]
+    totals = [a + b for a, b in zip(imports, builds)]
+    print(f"{args.runs} fresh processes, median (min) in ms")
+    print(f"  import app    {statistics.median(imports):7.1f} ({min(imports):.1f})")
+    print(f"  create_app()  {statistics.median(builds):7.1f} ({min(builds):.1f})")
+    print(f"  total         {statistics.median(totals):7.1f} ({min(totals):.1f})")
+    print("slowest imports of app (cumulative ms)")
+    for cumulative, name in slowest_imports(args.top):
+        print(f"  {cumulative / 1000:7.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
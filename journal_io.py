@@ -0,0 +1,188 @@
+# pylint: disable=no-member
+"""Exports a user's journal as JSON lines or CSV and imports one back. Both
+work a batch of entries at a time, so a journal of any size is never held
+in memory at once."""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from models import db, Entry, EntryTone
+from database_functions import score_entries
+from search import index_row
+
+# entries read or written per query and per committed transaction
+IO_BATCH_SIZE = 500
+
+# columns of an exported entry, in the order CSV writes them
+EXPORT_FIELDS = ["id", "title", "content", "timestamp", "tones", "emotion_scores"]
+
+FORMATS = {
+    "jsonl": ("application/x-ndjson", "journal.jsonl"),
+    "csv": ("text/csv", "journal.csv"),
+}
+
+
+class UnreadableFileError(Exception):
+    """Raised when an uploaded file stops being readable part way through.
+    imported and skipped count the records handled before that, the
+    imported ones are already saved."""
+
+    def __init__(self, imported, skipped):
+        super().__init__(f"The file could not be read after {imported} entries")
+        self.imported = imported
+        self.skipped = skipped
+
+
+def entry_batches(user_id, batch_size=IO_BATCH_SIZE):
+    """The user's entries as dicts of EXPORT_FIELDS, oldest first, one list
+    per query. Each query starts after the last id of the one before, so it
+    stays as fast at the end of a long journal as at the start."""
+    columns = [getattr(Entry, field) for field in EXPORT_FIELDS]
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(*columns)
+            .where(Entry.user == user_id, Entry.id > last_id)
+            .order_by(Entry.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        yield [_exported(row._asdict()) for row in rows]
+        last_id = rows[-1].id
+
+
+def _exported(entry):
+    if entry["timestamp"] is not None:
+        entry["timestamp"] = entry["timestamp"].isoformat()
+    if entry["emotion_scores"]:
+        entry["emotion_scores"] = json.loads(entry["emotion_scores"])
+    return entry
+
+
+def export_entries(user_id, file_format, batch_size=IO_BATCH_SIZE):
+    """Yields the user's journal as text in file_format ("jsonl" or "csv"),
+    one chunk per batch, to be streamed as the response body"""
+    if file_format == "jsonl":
+        for batch in entry_batches(user_id, batch_size):
+            yield "".join(json.dumps(entry) + "\n" for entry in batch)
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for batch in entry_batches(user_id, batch_size):
+        for entry in batch:
+            if entry["emotion_scores"]:
+                entry["emotion_scores"] = json.dumps(entry["emotion_scores"])
+            writer.writerow(entry)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # only the header, the journal is empty
+        yield buffer.getvalue()
+
+
+def _read_records(stream, file_format):
+    """Yields a dict for each record of an uploaded file, read as it is
+    parsed. Lines that are not a json object come back as None."""
+    # newline="" keeps line breaks inside quoted csv fields as they are
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        yield from csv.DictReader(text_stream)
+        return
+    for line in text_stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else None
+
+
+def _new_entry(user_id, record):
+    """The Entry for one imported record, or None when it would not pass the
+    checks /add_entry makes"""
+    title = str(record.get("title") or "")
+    content = str(record.get("content") or "")
+    if not 1 <= len(title) <= 50 or not 1 <= len(content) <= 1500:
+        return None
+    try:
+        timestamp = (
+            datetime.fromisoformat(record["timestamp"])
+            if record.get("timestamp")
+            else datetime.now()
+        )
+    except (TypeError, ValueError):
+        return None
+    entry = Entry(user=user_id, title=title, content=content, timestamp=timestamp)
+    # tones from an earlier export are kept instead of asking the api again,
+    # as long as they fit the columns they came from
+    tones = [tone for tone in str(record.get("tones") or "").split(",") if tone]
+    if tones and max(map(len, tones)) <= 20 and len(",".join(tones)) <= 100:
+        entry.tones = ",".join(tones)
+        entry.emotion_scores = _scores_json(record.get("emotion_scores"))
+        entry.tone_rows = [
+            EntryTone(emotion=tone, user=user_id) for tone in dict.fromkeys(tones)
+        ]
+    return entry
+
+
+def _scores_json(scores):
+    """Imported emotion scores as the json we store, None unless they are a
+    json object (already decoded from JSON lines, still text in CSV)"""
+    if isinstance(scores, str):
+        try:
+            scores = json.loads(scores)
+        except ValueError:
+            return None
+    return json.dumps(scores) if isinstance(scores, dict) else None
+
+
+def _save(batch):
+    """Scores and stores one batch of new entries in a single transaction"""
+    unscored = [entry for entry in batch if entry.tones is None]
+    if unscored:
+        try:
+            score_entries(unscored)
+        except Exception:  # pylint: disable=broad-except
+            # the sentiment api is unavailable, they are scored when viewed
+            for entry in unscored:
+                entry.emotion_scores = entry.tones = None
+                entry.tone_rows = []
+    db.session.add_all(batch)
+    # flush for the new ids, so the search index is updated in the same commit
+    db.session.flush()
+    for entry in batch:
+        index_row("entry", entry)
+    db.session.commit()
+
+
+def import_entries(user_id, stream, file_format, batch_size=IO_BATCH_SIZE):
+    """Adds the entries in an uploaded JSON lines or CSV file (a binary
+    stream) to the user's journal, batch_size entries per transaction.
+    Returns how many records were imported and how many were skipped.
+    Raises UnreadableFileError when the file is not utf-8 text or not csv
+    it can parse, the batches before that stay imported."""
+    imported = skipped = 0
+    batch = []
+    try:
+        for record in _read_records(stream, file_format):
+            entry = None if record is None else _new_entry(user_id, record)
+            if entry is None:
+                skipped += 1
+                continue
+            batch.append(entry)
+            if len(batch) == batch_size:
+                _save(batch)
+                imported += len(batch)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as error:
+        raise UnreadableFileError(imported, skipped) from error
+    if batch:
+        _save(batch)
+        imported += len(batch)
+    return imported, skipped
@@ -0,0 +1,580 @@
+"""Drives realistic traffic at the app and reports throughput and latency
+percentiles per route, so a change that slows a page down shows up as a
+number instead of a feeling.
+
+The app runs in its own process (gunicorn by default) against a throwaway
+sqlite database, or the one given with --database-url, filled with users,
+entries and task lists first. Every upstream api it calls (Openweather, NYT,
+NASA, the fun fact api, Twitter and paralleldots) is answered by a local stub
+that waits a set time before replying, so runs are repeatable and never
+touch the real apis.
+
+    python load_test.py --users 20 --duration 30 --entries 200
+    python load_test.py --latency 50 --latency nasa=800 --server flask
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# upstream name -> host the app calls it on
+UPSTREAM_HOSTS = {
+    "weather": "api.openweathermap.org",
+    "nyt": "api.nytimes.com",
+    "nasa": "api.nasa.gov",
+    "fun_fact": "api.aakhilv.me",
+    "twitter": "api.twitter.com",
+    "sentiment": "apis.paralleldots.com",
+}
+# milliseconds every stub waits before answering, unless --latency says otherwise
+DEFAULT_LATENCY_MS = 100
+
+# what a simulated user does next, and how often relative to the rest
+ACTIONS = {
+    "home": 30,
+    "view_entries": 20,
+    "older_entries": 5,
+    "search": 10,
+    "add_entry": 10,
+    "delete_entry": 5,
+    "add_task_list": 5,
+    "edit_task": 10,
+    "filter_entries": 5,
+}
+WIDGETS = ["weather_info", "fun_fact", "nyt", "twitter_trends", "nasa"]
+PASSWORD = "load-test"
+WORDS = """happy tired coffee work friends rain sunny walk dinner family
+    excited nervous meeting gym lonely proud book movie trip grateful""".split()
+
+
+def stub_response(host, path, form):
+    """The json a stubbed upstream answers with, shaped like the real api"""
+    if host == UPSTREAM_HOSTS["weather"]:
+        return {
+            "weather": [{"main": "Clouds"}],
+            "name": "Atlanta",
+            "sys": {"country": "US"},
+            "main": {"temp": 295.4},
+        }
+    if host == UPSTREAM_HOSTS["nyt"]:
+        return {
+            "results": [
+                {"title": f"Story {n}", "url": f"https://example.com/{n}"}
+                for n in range(20)
+            ]
+        }
+    if host == UPSTREAM_HOSTS["nasa"]:
+        return {
+            "hdurl": "https://apod.nasa.gov/apod/image/stub.jpg",
+            "url": "https://apod.nasa.gov/apod/image/stub_small.jpg",
+            "explanation": "A stub of the sky.",
+        }
+    if host == UPSTREAM_HOSTS["fun_fact"]:
+        return ["Owls can not move their eyes."]
+    if host == UPSTREAM_HOSTS["twitter"]:
+        return [{"trends": [{"name": f"#trend{n}"} for n in range(10)]}]
+    if host == UPSTREAM_HOSTS["sentiment"]:
+        scores = {"Happy": 0.4, "Sad": 0.1, "Angry": 0.05, "Fear": 0.05}
+        scores.update({"Excited": 0.3, "Bored": 0.1})
+        if path.endswith("emotion_batch"):
+            texts = json.loads(form.get("text", ["[]"])[0])
+            return {"emotion": [dict(scores) for _ in texts]}
+        return {"emotion": scores}
+    return None
+
+
+class StubServer(ThreadingHTTPServer):
+    """Answers for every upstream at http://127.0.0.1:<port>/<host>/<path>"""
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        # host -> seconds to wait before answering
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self.calls_lock = threading.Lock()
+
+    @property
+    def url(self):
+        """The address the app is pointed at"""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def _answer(self):
+        """Answers any request with the stub body of its upstream, after its latency"""
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip("/").partition("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode()) if length else {}
+        with self.server.calls_lock:
+            self.server.calls[host] += 1
+        time.sleep(self.server.latency.get(host, 0))
+        body = stub_response(host, path, form)
+        payload = json.dumps(body).encode()
+        self.send_response(200 if body is not None else 404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keeps every stub request out of the report"""
+        pass
+
+
+def route_upstreams_to(stub_url):
+    """Sends every requests call for an upstream host to the stub instead.
+    The app, tweepy and paralleldots all go through requests.Session, so
+    this one hook covers all of them. Only used in the load test's app
+    process."""
+    original = requests.Session.request
+    hosts = set(UPSTREAM_HOSTS.values())
+
+    def request(self, method, url, *args, **kwargs):
+        """requests.Session.request with upstream urls sent to the stub"""
+        parts = urlsplit(url)
+        if parts.hostname in hosts:
+            url = f"{stub_url}/{parts.hostname}{parts.path}"
+            if parts.query:
+                url += "?" + parts.query
+        return original(self, method, url, *args, **kwargs)
+
+    requests.Session.request = request
+
+
+def serve(stub_url, server, port):
+    """Runs the app with its upstreams stubbed, in the load test's child process"""
+    route_upstreams_to(stub_url)
+    if server == "flask":
+        # pylint: disable=import-outside-toplevel
+        from app import create_app
+
+        create_app().run(host="127.0.0.1", port=port, threaded=True)
+        return
+    from gunicorn.app.wsgiapp import run  # pylint: disable=import-outside-toplevel
+
+    sys.argv = ["gunicorn", "--config", "gunicorn.conf.py", "app:create_app()"]
+    sys.argv += ["--bind", f"127.0.0.1:{port}", "--access-logfile", "/dev/null"]
+    run()
+
+
+def seed(database_url, users, entries, task_lists):
+    """Creates the schema and the test users with their entries and task
+    lists. Users that already exist are left as they are."""
+    # scores for the seeded entries come from the offline word list
+    os.environ["SENTIMENT_BACKEND"] = "local"
+    # pylint: disable=import-outside-toplevel
+    from datetime import datetime, timedelta
+    from werkzeug.security import generate_password_hash
+    from app import create_app
+    from database_functions import score_entries
+    from migrations import upgrade
+    from models import db, Joes, Entry, Task
+    from search import index_row
+
+    app = create_app(
+        {"SQLALCHEMY_DATABASE_URI": database_url, "WIDGET_SCHEDULER": "off"}
+    )
+    password = generate_password_hash(PASSWORD)
+    rng = random.Random(0)
+    with app.app_context():
+        upgrade()
+        for number in range(users):
+            email = f"load{number}@example.com"
+            if Joes.query.filter_by(email=email).first():
+                continue
+            user = Joes(email=email, username=f"load{number}", password=password)
+            db.session.add(user)
+            db.session.flush()
+            now = datetime.now()
+            batch = [
+                Entry(
+                    user=user.id,
+                    title=f"Day {n}",
+                    content=" ".join(rng.choices(WORDS, k=30)),
+                    timestamp=now - timedelta(hours=12 * n),
+                )
+                for n in range(entries)
+            ]
+            score_entries(batch)
+            tasks = [
+                Task(user=user.id, title=f"List {n}", content="milk, eggs, bread")
+                for n in range(task_lists)
+            ]
+            db.session.add_all(batch + tasks)
+            db.session.flush()
+            for entry in batch:
+                index_row("entry", entry)
+            for task in tasks:
+                index_row("task", task)
+            db.session.commit()
+
+
+class Recorder:
+    """Collects the latency of every request, by route"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def record(self, route, seconds, ok):
+        """Counts one request to route, once the warm up is over"""
+        if not self.recording:
+            return
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of values, which must be sorted"""
+    index = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class VirtualUser(threading.Thread):
+    """One signed in user clicking around the app until told to stop"""
+
+    def __init__(self, base_url, number, recorder, stop, seed_value):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.email = f"load{number}@example.com"
+        self.recorder = recorder
+        self.stop = stop
+        self.rng = random.Random(seed_value)
+        self.session = requests.Session()
+        self.entry_ids = []
+        self.task_ids = []
+        self.older = None
+        self.failure = None
+
+    def call(self, route, method, path, **kwargs):
+        """Makes one request and records its latency under route"""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method,
+                self.base_url + path,
+                allow_redirects=False,
+                timeout=30,
+                **kwargs,
+            )
+        except requests.RequestException:
+            self.recorder.record(route, time.perf_counter() - start, False)
+            return None
+        self.recorder.record(
+            route, time.perf_counter() - start, response.status_code < 400
+        )
+        return response
+
+    def login(self):
+        """Signs in as this user, failing the user if it can't"""
+        response = self.call(
+            "POST /login",
+            "POST",
+            "/login",
+            data={"email": self.email, "pass": PASSWORD},
+        )
+        if response is None or response.status_code != 302:
+            raise RuntimeError(f"{self.email} could not log in")
+
+    def home(self):
+        """Opens the home page, then each widget the way the page does"""
+        response = self.call("GET /home", "GET", "/home")
+        if response is not None:
+            self.task_ids = re.findall(r"/edit_task/(\d+)", response.text)
+        # what the page then fetches for its widgets
+        for name in WIDGETS:
+            self.call(f"GET /widgets/{name}", "GET", f"/widgets/{name}")
+
+    def _read_entries(self, response):
+        """Remembers the entry ids and the older page cursor on a journal page"""
+        if response is not None:
+            self.entry_ids = re.findall(r'name="Delete" value=(\d+)', response.text)
+            older = re.search(r"before=(\d+)", response.text)
+            self.older = older.group(1) if older else None
+
+    def view_entries(self):
+        """Opens the first page of the journal"""
+        self._read_entries(self.call("GET /view_entries", "GET", "/view_entries"))
+
+    def older_entries(self):
+        """Follows the link to the next older page of the journal"""
+        if self.older is None:
+            return self.view_entries()
+        return self._read_entries(
+            self.call(
+                "GET /view_entries?before",
+                "GET",
+                "/view_entries",
+                params={"before": self.older},
+            )
+        )
+
+    def filter_entries(self):
+        """Filters the journal by a random emotion"""
+        self.call(
+            "POST /view_entries (emotion)",
+            "POST",
+            "/view_entries",
+            data={"sort_key": self.rng.choice(["Happy", "Sad", "Excited", "Bored"])},
+        )
+
+    def search(self):
+        """Searches entries and task lists for a random word"""
+        self.call("GET /search", "GET", "/search", params={"q": self.rng.choice(WORDS)})
+
+    def add_entry(self):
+        """Writes a new journal entry"""
+        self.call(
+            "POST /add_entry",
+            "POST",
+            "/add_entry",
+            data={
+                "title": "Load test",
+                "entry": " ".join(self.rng.choices(WORDS, k=30)),
+            },
+        )
+
+    def delete_entry(self):
+        """Deletes one of the entries last seen on the journal"""
+        if not self.entry_ids:
+            return self.view_entries()
+        entry_id = self.entry_ids.pop(self.rng.randrange(len(self.entry_ids)))
+        return self.call(
+            "POST /delete_entry", "POST", "/delete_entry", data={"Delete": entry_id}
+        )
+
+    def add_task_list(self):
+        """Adds a task list"""
+        self.call(
+            "POST /add_task_list",
+            "POST",
+            "/add_task_list",
+            data={"task_list_title": "Errands", "task_entry": "post office, bank"},
+        )
+
+    def edit_task(self):
+        """Edits one of the task lists last seen on the home page"""
+        if not self.task_ids:
+            return self.home()
+        task_id = self.rng.choice(self.task_ids)
+        return self.call(
+            "POST /edit_task/<id>",
+            "POST",
+            f"/edit_task/{task_id}",
+            data={"task_edit": "milk, eggs, bread, " + self.rng.choice(WORDS)},
+        )
+
+    def run(self):
+        """Signs in, then does weighted random actions until stopped"""
+        names = list(ACTIONS)
+        weights = [ACTIONS[name] for name in names]
+        try:
+            self.login()
+            while not self.stop.is_set():
+                getattr(self, self.rng.choices(names, weights)[0])()
+        except Exception as error:  # pylint: disable=broad-except
+            self.failure = error
+
+
+def wait_until_up(base_url, timeout):
+    """Waits for the app to answer at base_url, for at most timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + "/login", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"the app did not come up at {base_url} in {timeout}s")
+
+
+def report(recorder, duration, calls):
+    """Per route rows of count, errors, requests/s and latency percentiles in
+    ms, as a dict that is also printed as a table"""
+    rows = {}
+    for route in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[route])
+        rows[route] = {
+            "count": len(values),
+            "errors": recorder.errors[route],
+            "rps": len(values) / duration,
+            "p50": percentile(values, 0.50) * 1000,
+            "p90": percentile(values, 0.90) * 1000,
+            "p99": percentile(values, 0.99) * 1000,
+            "max": values[-1] * 1000,
+        }
+    total = sum(row["count"] for row in rows.values())
+    header = f"{'route':32} {'count':>7} {'err':>5} {'req/s':>8}"
+    print(header + f" {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  (ms)")
+    for route, row in rows.items():
+        print(
+            f"{route:32} {row['count']:7d} {row['errors']:5d} {row['rps']:8.1f}"
+            f" {row['p50']:8.1f} {row['p90']:8.1f} {row['p99']:8.1f} {row['max']:8.1f}"
+        )
+    print(f"{'total':32} {total:7d} {'':5} {total / duration:8.1f}")
+    print("upstream calls: " + ", ".join(f"{h}={n}" for h, n in sorted(calls.items())))
+    return {"duration": duration, "routes": rows, "upstream_calls": dict(calls)}
+
+
+def parse_latency(values):
+    """--latency 50 --latency nasa=800 -> {host: seconds} for every upstream"""
+    default = DEFAULT_LATENCY_MS
+    overrides = {}
+    for value in values:
+        name, _, milliseconds = value.rpartition("=")
+        if not name:
+            default = float(milliseconds)
+        elif name in UPSTREAM_HOSTS:
+            overrides[name] = float(milliseconds)
+        else:
+            raise SystemExit(
+                f"unknown upstream {name}, pick from {list(UPSTREAM_HOSTS)}"
+            )
+    return {
+        host: overrides.get(name, default) / 1000
+        for name, host in UPSTREAM_HOSTS.items()
+    }
+
+
+def main():
+    """Seeds the database, starts the stubs and the app, and runs the users"""
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n", maxsplit=1)[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--users", type=int, default=10, help="simulated users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds not measured")
+    parser.add_argument("--entries", type=int, default=100, help="entries per user")
+    parser.add_argument("--task-lists", type=int, default=5, help="task lists per user")
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="[UPSTREAM=]MS",
+        help=f"stub latency, for all or one of {', '.join(UPSTREAM_HOSTS)}",
+    )
+    parser.add_argument("--database-url", help="defaults to a new sqlite file")
+    parser.add_argument("--server", choices=["gunicorn", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads")
+    parser.add_argument(
+        "--sentiment",
+        choices=["remote", "local", "local-first"],
+        default="remote",
+        help="SENTIMENT_BACKEND of the app, remote uses the stub",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument(
+        "--serve", nargs=2, metavar=("STUB_URL", "SERVER"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve[0], args.serve[1], args.port)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    database_url = args.database_url or f"sqlite:///{workdir}/load_test.db"
+    print(f"seeding {args.users} users with {args.entries} entries each")
+    seed(database_url, args.users, args.entries, args.task_lists)
+
+    stubs = StubServer(parse_latency(args.latency))
+    threading.Thread(target=stubs.serve_forever, daemon=True).start()
+
+    env = dict(os.environ)
+    env.update(
+        {
+            "DATABASE_URL": database_url,
+            "SECRET": "load-test",
+            "PORT": str(args.port),
+            "WEB_CONCURRENCY": str(args.workers),
+            "GUNICORN_THREADS": str(args.threads),
+            "WIDGET_SNAPSHOT_DIR": os.path.join(workdir, "widgets"),
+            "SENTIMENT_BACKEND": args.sentiment,
+        }
+    )
+    for name in ["TWITTER_KEY", "TWITTER_SECRET", "SENTIMENT_KEY", "NASA_KEY"]:
+        env.setdefault(name, "stub")
+    os.makedirs(env["WIDGET_SNAPSHOT_DIR"], exist_ok=True)
+    log_path = os.path.join(workdir, "app.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        app_process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, __file__, "--port", str(args.port), "--serve"]
+            + [stubs.url, args.server],
+            cwd=HERE,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_up(base_url, 30)
+        recorder = Recorder()
+        stop = threading.Event()
+        users = [
+            VirtualUser(base_url, number, recorder, stop, number)
+            for number in range(args.users)
+        ]
+        print(f"{args.server}: {args.users} users, {args.warmup}s warm up")
+        for user in users:
+            user.start()
+        time.sleep(args.warmup)
+        recorder.recording = True
+        calls_before = dict(stubs.calls)
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        recorder.recording = False
+        measured = time.perf_counter() - started
+        calls = {h: n - calls_before.get(h, 0) for h, n in stubs.calls.items()}
+        stop.set()
+        for user in users:
+            user.join(timeout=35)
+        failures = [user.failure for user in users if user.failure]
+        if failures:
+            print(f"{len(failures)} users stopped early: {failures[0]!r}")
+        results = report(recorder, measured, calls)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as output:
+                json.dump(results, output, indent=2)
+    except RuntimeError as error:
+        print(f"{error}, see {log_path}")
+        raise SystemExit(1) from error
+    finally:
+        app_process.send_signal(signal.SIGTERM)
+        try:
+            app_process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            app_process.kill()
+        stubs.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Latency histograms for every request, upstream api call and database
+query, shown on /metrics in the Prometheus text format. Each process keeps
+its own numbers in memory; under gunicorn every worker also writes them to a
+file in METRICS_DIR, and /metrics adds those up, so it reports the whole
+server whichever worker answers it."""
+
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bounds in seconds, the same as prometheus' default buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# how often a worker writes its numbers to METRICS_DIR when they changed
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+# name -> Histogram, in the order they are shown
+REGISTRY = {}
+
+
+class Histogram:
+    """Counts of observed seconds per bucket, with their sum, for each
+    combination of label values"""
+
+    def __init__(self, name, documentation, labelnames, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count above the last, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, seconds, *label_values):
+        """Counts one observation of seconds under label_values"""
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            values[bucket] += 1
+            values[-1] += seconds
+        _changed()
+
+    def snapshot(self):
+        """[[label values, values]] as plain lists, to be written as json"""
+        with self._lock:
+            return [
+                [list(labels), list(values)] for labels, values in self._values.items()
+            ]
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve a request, by route pattern",
+    ("method", "route", "status"),
+)
+UPSTREAM_SECONDS = Histogram(
+    "upstream_request_duration_seconds",
+    "Time a call to an upstream api took, retries included",
+    ("upstream", "outcome"),
+)
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time a database_functions call took",
+    ("query", "outcome"),
+)
+
+
+@contextmanager
+def timer(histogram, *label_values):
+    """Observes how long the block takes, with an outcome label of "ok", or
+    "error" when it raises, added after label_values"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        histogram.observe(time.perf_counter() - start, *label_values, outcome)
+
+
+def timed(histogram, *label_values):
+    """Decorator version of timer, for a function timed on every call"""
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(histogram, *label_values):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# writing to METRICS_DIR, see start_flusher
+_dirty = threading.Event()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def metrics_dir():
+    """The folder every worker writes its numbers to, or None when this
+    process is the whole server. Read on each use, gunicorn sets it after
+    the app is imported."""
+    return os.getenv("METRICS_DIR") or None
+
+
+def _path(folder, pid):
+    return os.path.join(folder, f"{pid}.json")
+
+
+def snapshot():
+    """This process's numbers, {histogram name: [[label values, values]]}"""
+    return {name: histogram.snapshot() for name, histogram in REGISTRY.items()}
+
+
+def flush():
+    """Writes this process's numbers to METRICS_DIR atomically, so readers
+    never see half a file"""
+    folder = metrics_dir()
+    if folder is None:
+        return
+    _dirty.clear()
+    handle, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    with os.fdopen(handle, "w", encoding="utf-8") as file:
+        json.dump(snapshot(), file)
+    os.replace(tmp_path, _path(folder, os.getpid()))
+
+
+def _flush_loop():
+    while True:
+        _dirty.wait()
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            # the folder is gone, e.g. the server is shutting down
+            pass
+
+
+def _changed():
+    _dirty.set()
+    if _flusher is None and metrics_dir() is not None:
+        start_flusher()
+
+
+def start_flusher():
+    """Starts the thread writing this process's numbers, once per process"""
+    global _flusher  # pylint: disable=global-statement
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_loop, name="metrics-flusher", daemon=True
+            )
+            _flusher.start()
+
+
+def _after_fork():
+    # a new worker starts from zero and writes its own file with its own thread
+    global _flusher, _flusher_lock  # pylint: disable=global-statement
+    for histogram in REGISTRY.values():
+        histogram.reset()
+    _dirty.clear()
+    _flusher = None
+    _flusher_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def clear_dir(folder):
+    """Creates folder, or empties it of numbers from an earlier server"""
+    os.makedirs(folder, exist_ok=True)
+    for name in os.listdir(folder):
+        if name.endswith((".json", ".tmp")):
+            os.remove(os.path.join(folder, name))
+
+
+def collect():
+    """Every histogram added up over the files in METRICS_DIR, with this
+    process's own numbers taken live. Files of workers that have exited are
+    kept, so totals never go down when a worker is replaced."""
+    snapshots = [snapshot()]
+    folder = metrics_dir()
+    if folder is not None:
+        own = _path(folder, os.getpid())
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not name.endswith(".json") or path == own:
+                continue
+            try:
+                with open(path, encoding="utf-8") as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+    totals = {name: {} for name in REGISTRY}
+    for process in snapshots:
+        for name, rows in process.items():
+            if name not in totals:
+                continue
+            for labels, values in rows:
+                total = totals[name].setdefault(tuple(labels), [0] * len(values))
+                for index, value in enumerate(values):
+                    total[index] += value
+    return totals
+
+
+def _label_text(names, values, extra=""):
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", r"\\").replace('"', r"\""))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(totals):
+    """totals from collect in the Prometheus text exposition format"""
+    lines = []
+    for name, histogram in REGISTRY.items():
+        lines.append(f"# HELP {name} {histogram.documentation}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, values in sorted(totals.get(name, {}).items()):
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in histogram.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, values[:-1]):
+                cumulative += count
+                label_text = _label_text(histogram.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{name}_bucket{label_text} {cumulative}")
+            label_text = _label_text(histogram.labelnames, labels)
+            lines.append(f"{name}_sum{label_text} {values[-1]!r}")
+            lines.append(f"{name}_count{label_text} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def init_metrics(app):
+    """Times every request app serves, labelled with its route pattern rather
+    than its url so ids in the path don't make a new series each"""
+    # pylint: disable=import-outside-toplevel
+    from flask import g, request
+
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    def remember_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    def observe(_error):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+        status = g.pop("metrics_status", 500)
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start, request.method, rule, str(status)
+        )
+
+    # first, so the time spent in the other hooks is counted too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+    app.after_request(remember_status)
+    app.teardown_request(observe)
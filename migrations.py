@@ -0,0 +1,228 @@
+# pylint: disable=no-member
+"""Schema upgrades for databases that were created before a column existed.
+db.create_all() only creates missing tables, so columns added to existing
+tables are added here. Every step checks first, so running it again is safe."""
+
+from datetime import datetime
+from sqlalchemy import DateTime, Integer, bindparam, inspect, text
+from models import db, Entry, EntryTone, Task
+from search import create_search_index
+
+
+def _columns(table):
+    """Names of the columns the table has in the database right now"""
+    return {column["name"] for column in inspect(db.engine).get_columns(table)}
+
+
+def _column_type(table, name):
+    """Type of one column as the database reports it"""
+    for column in inspect(db.engine).get_columns(table):
+        if column["name"] == name:
+            return column["type"]
+    return None
+
+
+def _foreign_keys(table):
+    """Names of the columns of table that already reference another table"""
+    return {
+        column
+        for key in inspect(db.engine).get_foreign_keys(table)
+        for column in key["constrained_columns"]
+    }
+
+
+def add_entry_emotion_columns():
+    """Stores sentiment results with each entry"""
+    columns = _columns("entry")
+    with db.engine.begin() as connection:
+        if "emotion_scores" not in columns:
+            connection.execute(text("ALTER TABLE entry ADD COLUMN emotion_scores TEXT"))
+        if "tones" not in columns:
+            connection.execute(text("ALTER TABLE entry ADD COLUMN tones VARCHAR(100)"))
+
+
+def add_user_location_columns():
+    """Lets each user see the weather where they are"""
+    columns = _columns("joes")
+    with db.engine.begin() as connection:
+        for name in ("latitude", "longitude"):
+            if name not in columns:
+                connection.execute(text(f"ALTER TABLE joes ADD COLUMN {name} FLOAT"))
+
+
+def add_user_trends_column():
+    """Lets each user pick the region their twitter trends come from"""
+    if "trends_woeid" not in _columns("joes"):
+        with db.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE joes ADD COLUMN trends_woeid INTEGER"))
+
+
+def add_task_position_column():
+    """Lets each user put their task lists in their own order"""
+    if "position" not in _columns("task"):
+        with db.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE task ADD COLUMN position INTEGER"))
+
+
+def fill_entry_tones(batch_size=500):
+    """Copies tones that were stored on entries into the tone table"""
+    last_id = 0
+    while True:
+        batch = (
+            Entry.query.filter(
+                Entry.id > last_id,
+                Entry.tones.isnot(None),
+                ~Entry.tone_rows.any(),
+            )
+            .order_by(Entry.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return
+        for entry in batch:
+            entry.tone_rows = [
+                EntryTone(emotion=tone, user=entry.user)
+                for tone in dict.fromkeys(entry.tone_list)
+            ]
+        db.session.commit()
+        last_id = batch[-1].id
+
+
+# legacy task lists point at their owner by username, or by the id as text
+_TASK_OWNER = (
+    "COALESCE("
+    '(SELECT joes.id FROM joes WHERE joes.username = task_legacy."user"), '
+    '(SELECT joes.id FROM joes WHERE CAST(joes.id AS VARCHAR(100)) = task_legacy."user"))'
+)
+
+
+def task_user_to_foreign_key():
+    """Task.user used to hold the username as text. It now holds Joes.id like
+    Entry.user does, so task lists are found by an indexed integer. Task lists
+    whose owner no longer exists can never be shown again and are dropped."""
+    if isinstance(_column_type("task", "user"), Integer):
+        return
+    with db.engine.begin() as connection:
+        if db.engine.dialect.name == "postgresql":
+            statements = [
+                'ALTER TABLE task RENAME COLUMN "user" TO user_legacy',
+                'ALTER TABLE task ADD COLUMN "user" INTEGER',
+                'UPDATE task SET "user" = '
+                + _TASK_OWNER.replace('task_legacy."user"', "task.user_legacy"),
+                'DELETE FROM task WHERE "user" IS NULL',
+                "ALTER TABLE task DROP COLUMN user_legacy",
+                'ALTER TABLE task ALTER COLUMN "user" SET NOT NULL',
+                "ALTER TABLE task ADD CONSTRAINT task_user_fkey"
+                ' FOREIGN KEY ("user") REFERENCES joes (id)',
+            ]
+            for statement in statements:
+                connection.execute(text(statement))
+            return
+        # sqlite can't change a column's type, so the table is rebuilt
+        connection.execute(text("ALTER TABLE task RENAME TO task_legacy"))
+        Task.__table__.create(connection)
+        connection.execute(
+            text(
+                'INSERT INTO task (id, "user", title, content) '
+                f"SELECT id, {_TASK_OWNER}, title, content FROM task_legacy "
+                f"WHERE {_TASK_OWNER} IS NOT NULL"
+            )
+        )
+        connection.execute(text("DROP TABLE task_legacy"))
+
+
+def entry_user_foreign_key():
+    """Makes Entry.user reference Joes.id. Sqlite can't add a constraint to an
+    existing table (and doesn't enforce them by default), so this is postgres only.
+    NOT VALID keeps old rows as they are and checks every new one."""
+    if db.engine.dialect.name != "postgresql" or "user" in _foreign_keys("entry"):
+        return
+    with db.engine.begin() as connection:
+        connection.execute(
+            text(
+                "ALTER TABLE entry ADD CONSTRAINT entry_user_fkey"
+                ' FOREIGN KEY ("user") REFERENCES joes (id) NOT VALID'
+            )
+        )
+
+
+def _parse_legacy_timestamp(value):
+    """Reads the "M/D/YYYY" text formation() used to store, None if it can't"""
+    try:
+        return datetime.strptime(value.strip(), "%m/%d/%Y")
+    except (AttributeError, ValueError):
+        return None
+
+
+def entry_timestamp_to_datetime(batch_size=1000):
+    """Entry.timestamp used to be "M/D/YYYY" text, which can't be sorted or
+    range-queried. It is now a real DateTime; the old text is parsed into it
+    in batches and rows that can't be read are left empty."""
+    if isinstance(_column_type("entry", "timestamp"), DateTime):
+        return
+    column_type = DateTime().compile(dialect=db.engine.dialect)
+    with db.engine.begin() as connection:
+        connection.execute(
+            text('ALTER TABLE entry RENAME COLUMN "timestamp" TO timestamp_legacy')
+        )
+        connection.execute(
+            text(f'ALTER TABLE entry ADD COLUMN "timestamp" {column_type}')
+        )
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                text(
+                    "SELECT id, timestamp_legacy FROM entry WHERE id > :last_id"
+                    " AND timestamp_legacy IS NOT NULL ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": batch_size},
+            ).all()
+            if not rows:
+                break
+            parsed = [
+                {"id": row[0], "timestamp": _parse_legacy_timestamp(row[1])}
+                for row in rows
+            ]
+            parsed = [row for row in parsed if row["timestamp"] is not None]
+            if parsed:
+                # bound as a DateTime so it is stored in the same format the
+                # orm compares against, sqlite compares them as text
+                connection.execute(
+                    text(
+                        'UPDATE entry SET "timestamp" = :timestamp WHERE id = :id'
+                    ).bindparams(bindparam("timestamp", type_=DateTime)),
+                    parsed,
+                )
+            last_id = rows[-1][0]
+        connection.execute(text("ALTER TABLE entry DROP COLUMN timestamp_legacy"))
+
+
+def create_missing_indexes():
+    """Creates every index declared in models.py that the database lacks"""
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+# run in order, new steps go at the end
+STEPS = [
+    add_entry_emotion_columns,
+    fill_entry_tones,
+    task_user_to_foreign_key,
+    entry_user_foreign_key,
+    entry_timestamp_to_datetime,
+    create_missing_indexes,
+    create_search_index,
+    add_user_location_columns,
+    add_user_trends_column,
+    add_task_position_column,
+]
+
+
+def upgrade():
+    """Brings an existing database up to date with models.py"""
+    db.create_all()
+    for step in STEPS:
+        step()
@@ -15,6 +15,11 @@ class Joes(db.Model, UserMixin):
     email = db.Column(db.String(100), unique=True, nullable=False)
     username = db.Column(db.String(20), unique=True, nullable=False)
     password = db.Column(db.String(500), nullable=False)
+    # where the weather widget reports from, empty until the user shares it
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # region the trends widget shows, empty for the default (United States)
+    trends_woeid = db.Column(db.Integer)
 
     def __repr__(self):
         return "Username %r" % self.username
@@ -25,11 +30,29 @@ class Entry(db.Model):
     which will be stored in our database.
     """
 
+    # the journal listing pages through a user's entries by id, and can be
+    # narrowed to a date range
+    __table_args__ = (
+        db.Index("ix_entry_user_id", "user", "id"),
+        db.Index("ix_entry_user_timestamp", "user", "timestamp"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user = db.Column(db.Integer, nullable=False)
+    user = db.Column(db.Integer, db.ForeignKey("joes.id"), nullable=False)
     title = db.Column(db.String(50), nullable=False)
     content = db.Column(db.String(1500), nullable=False)
-    timestamp = db.Column(db.String(100))
+    timestamp = db.Column(db.DateTime)
+    # scores from the sentiment api as json, and the tones we show for them
+    emotion_scores = db.Column(db.Text)
+    tones = db.Column(db.String(100))
+    tone_rows = db.relationship(
+        "EntryTone", cascade="all, delete-orphan", passive_deletes=True
+    )
+
+    @property
+    def tone_list(self):
+        """The stored tones as a list, empty when they were never scored"""
+        return self.tones.split(",") if self.tones else []
 
     def __repr__(self):
         return "User: %s posted: %s, and titled it ' %s ', at " "the time of %s" % (
@@ -40,15 +63,39 @@ class Entry(db.Model):
         )
 
 
+class EntryTone(db.Model):
+    """One tone of one journal entry, kept in its own indexed table so the
+    entries page can filter by emotion in the database.
+    """
+
+    __table_args__ = (
+        db.Index("ix_entry_tone_user_emotion_entry", "user", "emotion", "entry_id"),
+    )
+
+    entry_id = db.Column(
+        db.Integer, db.ForeignKey("entry.id", ondelete="CASCADE"), primary_key=True
+    )
+    emotion = db.Column(db.String(20), primary_key=True)
+    user = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return "Entry %s sounds %s" % (self.entry_id, self.emotion)
+
+
 class Task(db.Model):
     """This will create our entry object portion,
     which will be stored in our database.
     """
 
+    # the home page lists a user's task lists by id
+    __table_args__ = (db.Index("ix_task_user_id", "user", "id"),)
+
     id = db.Column(db.Integer, primary_key=True)
-    user = db.Column(db.String(100), nullable=False)
+    user = db.Column(db.Integer, db.ForeignKey("joes.id"), nullable=False)
     title = db.Column(db.String(50), nullable=False)
     content = db.Column(db.String(1500), nullable=False)
+    # where the user moved the list to, lists never moved are placed by id
+    position = db.Column(db.Integer)
 
     def __repr__(self):
         return "User: %s posted: %s, and titled it ' %s" % (
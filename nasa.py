@@ -1,18 +1,23 @@
 """Nasa API"""
 import os
-import requests
-from dotenv import find_dotenv, load_dotenv
+import http_client
+from metrics import timed, UPSTREAM_SECONDS
 
-
-load_dotenv(find_dotenv())
 NASA_KEY = os.getenv("NASA_KEY")
 
 
+@timed(UPSTREAM_SECONDS, "nasa")
 def nasa_picture():
     """Displays the daily picture from nasa"""
-    responses = requests.get(f"https://api.nasa.gov/planetary/apod?api_key={NASA_KEY}")
-    responses_json = responses.json()
-    picture = responses_json["hdurl"]
+    responses_json = http_client.get_json(
+        "https://api.nasa.gov/planetary/apod",
+        params={"api_key": NASA_KEY, "thumbs": "True"},
+    )
+    if responses_json.get("media_type", "image") == "image":
+        picture = responses_json.get("hdurl") or responses_json["url"]
+    else:
+        # on video days there is no hdurl, only the video and a thumbnail of it
+        picture = responses_json.get("thumbnail_url")
     explanation = responses_json["explanation"]
 
     nasa_result = {
@@ -2,27 +2,36 @@
 Openweather API to display current weather information
 """
 import os
-import requests
-from dotenv import find_dotenv, load_dotenv
+import http_client
+from metrics import timed, UPSTREAM_SECONDS
 
-
-load_dotenv(find_dotenv())
-
-# Hardcoded the lat/lon until I can figure out best way to implement geolocation feature
+# Atlanta, shown to users who haven't shared their location
 LAT = 33.7499
 LON = -84.4000
 
-OPENWEATHER_URL = (
-    f"https://api.openweathermap.org/data/2.5/weather?lat={LAT}&lon={LON}&appid="
-)
+# users are grouped into cells this many degrees wide (about 11km), everyone
+# in a cell shares one upstream call
+WEATHER_GRID = float(os.getenv("WEATHER_GRID", "0.1"))
+
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
 
 OPENWEATHER_KEY = os.getenv("OPENWEATHER_KEY")
 
 
-def get_weather():
+def weather_cell(lat, lon):
+    """Snaps a location to the centre of its grid cell"""
+    return (
+        round(round(lat / WEATHER_GRID) * WEATHER_GRID, 4),
+        round(round(lon / WEATHER_GRID) * WEATHER_GRID, 4),
+    )
+
+
+@timed(UPSTREAM_SECONDS, "openweather")
+def get_weather(lat=LAT, lon=LON):
     """Recieves responses from openweather API for temperture, city and current weather."""
-    responses = requests.get(OPENWEATHER_URL + OPENWEATHER_KEY)
-    responses_json = responses.json()
+    responses_json = http_client.get_json(
+        OPENWEATHER_URL, params={"lat": lat, "lon": lon, "appid": OPENWEATHER_KEY}
+    )
     weather = responses_json["weather"][0]["main"]
     city = responses_json["name"]
     country = responses_json["sys"]["country"]
@@ -0,0 +1,146 @@
+"""Refreshes the shared widgets in the background before they expire, so
+/home only ever reads snapshots that are already there"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on windows, every process refreshes alone
+    fcntl = None
+
+from breaker import CircuitOpenError
+from cache import widget_cache
+from widgets import CACHE_POLICY, UPSTREAMS
+
+logger = logging.getLogger(__name__)
+
+# snapshots are shared by every worker process on the machine through this folder
+SNAPSHOT_DIR = os.getenv(
+    "WIDGET_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "my-daily-cup-widgets")
+)
+# how often the scheduler wakes up, and how far into its ttl a widget is refreshed
+SCHEDULER_TICK = float(os.getenv("WIDGET_SCHEDULER_TICK", "15"))
+REFRESH_AT = 0.8
+
+_stop = threading.Event()
+_thread = None
+_start_lock = threading.Lock()
+
+
+def _snapshot_path(snapshot_dir, name):
+    return os.path.join(snapshot_dir, name + ".json")
+
+
+def read_snapshot(snapshot_dir, name):
+    """Returns (value, fetched_at) written by any worker, or None"""
+    try:
+        with open(_snapshot_path(snapshot_dir, name), encoding="utf-8") as snapshot:
+            data = json.load(snapshot)
+        return data["value"], data["fetched_at"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_snapshot(snapshot_dir, name, value, fetched_at):
+    """Writes a snapshot atomically so readers never see half a file"""
+    handle, tmp_path = tempfile.mkstemp(dir=snapshot_dir, suffix=".tmp")
+    with os.fdopen(handle, "w", encoding="utf-8") as snapshot:
+        json.dump({"value": value, "fetched_at": fetched_at}, snapshot)
+    os.replace(tmp_path, _snapshot_path(snapshot_dir, name))
+
+
+def _try_lock(snapshot_dir, name):
+    """Returns an open lock file if this process may refresh name, else None"""
+    lock_file = open(  # pylint: disable=consider-using-with
+        os.path.join(snapshot_dir, name + ".lock"), "w", encoding="utf-8"
+    )
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _newest(cache, snapshot_dir, name):
+    """Copies a newer snapshot from another worker into our cache and
+    returns the fetch time of the newest copy we know about"""
+    snapshot = read_snapshot(snapshot_dir, name)
+    if snapshot is not None:
+        cache.put(name, snapshot[0], snapshot[1])
+    entry = cache.peek(name)
+    return None if entry is None else entry[1]
+
+
+def refresh_due(
+    cache=widget_cache,
+    upstreams=UPSTREAMS,
+    policy=CACHE_POLICY,
+    snapshot_dir=SNAPSHOT_DIR,
+):
+    """One pass of the scheduler. Every widget that is close to expiring is
+    fetched again by exactly one worker; the others pick the result up from
+    its snapshot. Returns the names this process refreshed."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    refreshed = []
+    for name, (ttl, _max_stale) in policy.items():
+        fetched_at = _newest(cache, snapshot_dir, name)
+        if fetched_at is not None and time.time() - fetched_at < ttl * REFRESH_AT:
+            continue
+        lock_file = _try_lock(snapshot_dir, name)
+        if lock_file is None:
+            # another worker is refreshing it right now
+            continue
+        try:
+            # it may have been refreshed while we waited for the lock
+            fetched_at = _newest(cache, snapshot_dir, name)
+            if fetched_at is not None and time.time() - fetched_at < ttl * REFRESH_AT:
+                continue
+            value = upstreams[name]()
+            fetched_at = time.time()
+            write_snapshot(snapshot_dir, name, value, fetched_at)
+            cache.put(name, value, fetched_at)
+            refreshed.append(name)
+        except CircuitOpenError:
+            # the api has been failing, its circuit lets a call through later
+            pass
+        except Exception:  # pylint: disable=broad-except
+            # keep serving the last snapshot, try again next tick
+            logger.exception("Could not refresh the %s widget", name)
+        finally:
+            lock_file.close()
+    return refreshed
+
+
+def _run():
+    while not _stop.is_set():
+        refresh_due()
+        _stop.wait(SCHEDULER_TICK)
+
+
+def start_scheduler():
+    """Starts the background refresh thread once per process. Cheap to call
+    again, so the app calls it before every request."""
+    global _thread  # pylint: disable=global-statement
+    if _thread is not None and _thread.is_alive():
+        return
+    with _start_lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _stop.clear()
+        _thread = threading.Thread(target=_run, name="widget-scheduler", daemon=True)
+        _thread.start()
+
+
+def stop_scheduler():
+    """Asks the background refresh thread to finish"""
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=SCHEDULER_TICK)
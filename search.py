@@ -0,0 +1,179 @@
+# pylint: disable=no-member
+"""Full-text search over journal entries and task lists. Postgres keeps a
+tsvector column with a GIN index, sqlite (for local runs) an FTS5 table.
+The index is updated in the same transaction as the rows it mirrors."""
+
+import re
+
+from sqlalchemy import bindparam, text
+
+from models import db, Entry, Task
+
+# how many results one page of search shows
+SEARCH_PAGE_SIZE = 10
+
+# kind stored in the index -> model it points at
+KINDS = {"entry": Entry, "task": Task}
+
+_WORD = re.compile(r"\w+")
+
+_POSTGRES_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS search_index (
+        kind VARCHAR(10) NOT NULL,
+        ref_id INTEGER NOT NULL,
+        owner INTEGER NOT NULL,
+        title TEXT,
+        content TEXT,
+        document TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(content, '')), 'B')
+        ) STORED,
+        PRIMARY KEY (kind, ref_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_document"
+    " ON search_index USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_owner ON search_index (owner)",
+]
+
+_SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "title, content, kind UNINDEXED, ref_id UNINDEXED, owner UNINDEXED)",
+]
+
+
+def _is_postgres():
+    return db.engine.dialect.name == "postgresql"
+
+
+def _rowid(kind, ref_id):
+    """sqlite rows are addressed by rowid, so entries and tasks share one
+    table without their ids colliding"""
+    return ref_id * len(KINDS) + list(KINDS).index(kind)
+
+
+def create_search_index():
+    """Creates the search table if it is missing and fills it once from the
+    entries and task lists that already exist"""
+    with db.engine.begin() as connection:
+        for statement in _POSTGRES_SCHEMA if _is_postgres() else _SQLITE_SCHEMA:
+            connection.execute(text(statement))
+        if connection.execute(text("SELECT 1 FROM search_index LIMIT 1")).first():
+            return
+    for kind, model in KINDS.items():
+        last_id = 0
+        while True:
+            batch = (
+                model.query.filter(model.id > last_id)
+                .order_by(model.id)
+                .limit(1000)
+                .all()
+            )
+            if not batch:
+                break
+            for row in batch:
+                index_row(kind, row)
+            db.session.commit()
+            last_id = batch[-1].id
+
+
+def index_row(kind, row):
+    """Adds or replaces one entry or task list in the index. Runs in the
+    caller's transaction, so the row needs an id (flush it first)."""
+    index_rows(kind, [row])
+
+
+def index_rows(kind, rows):
+    """index_row for many entries or task lists of one kind, with one
+    statement for all of them. rows only need id, user, title and content."""
+    values = [
+        {
+            "kind": kind,
+            "ref_id": row.id,
+            "owner": row.user,
+            "title": row.title,
+            "content": row.content,
+        }
+        for row in rows
+    ]
+    if not values:
+        return
+    if _is_postgres():
+        db.session.execute(
+            text(
+                "INSERT INTO search_index (kind, ref_id, owner, title, content)"
+                " VALUES (:kind, :ref_id, :owner, :title, :content)"
+                " ON CONFLICT (kind, ref_id) DO UPDATE SET owner = excluded.owner,"
+                " title = excluded.title, content = excluded.content"
+            ),
+            values,
+        )
+        return
+    for value in values:
+        value["rowid"] = _rowid(kind, value["ref_id"])
+    remove_rows(kind, [value["ref_id"] for value in values])
+    db.session.execute(
+        text(
+            "INSERT INTO search_index (rowid, title, content, kind, ref_id, owner)"
+            " VALUES (:rowid, :title, :content, :kind, :ref_id, :owner)"
+        ),
+        values,
+    )
+
+
+def remove_rows(kind, ref_ids):
+    """Takes entries or task lists out of the index in the caller's
+    transaction, with one statement however many there are"""
+    if not ref_ids:
+        return
+    if _is_postgres():
+        db.session.execute(
+            text(
+                "DELETE FROM search_index WHERE kind = :kind AND ref_id IN :ref_ids"
+            ).bindparams(bindparam("ref_ids", expanding=True)),
+            {"kind": kind, "ref_ids": list(ref_ids)},
+        )
+        return
+    db.session.execute(
+        text("DELETE FROM search_index WHERE rowid IN :rowids").bindparams(
+            bindparam("rowids", expanding=True)
+        ),
+        {"rowids": [_rowid(kind, ref_id) for ref_id in ref_ids]},
+    )
+
+
+def search(user_id, query, page=1, page_size=SEARCH_PAGE_SIZE):
+    """Best matches for query among the user's entries and task lists.
+    Returns (results, has_more) where each result is a dict with kind, id,
+    title and content."""
+    words = _WORD.findall(query.lower())
+    if not words:
+        return [], False
+    values = {
+        "owner": user_id,
+        "limit": page_size + 1,
+        "offset": (max(page, 1) - 1) * page_size,
+    }
+    if _is_postgres():
+        values["query"] = " ".join(words)
+        statement = (
+            "SELECT kind, ref_id, title, content FROM search_index,"
+            " websearch_to_tsquery('english', :query) AS query"
+            " WHERE owner = :owner AND document @@ query"
+            " ORDER BY ts_rank(document, query) DESC, ref_id DESC"
+            " LIMIT :limit OFFSET :offset"
+        )
+    else:
+        # every word has to appear, the last one may still be being typed
+        values["query"] = " ".join(f'"{word}"' for word in words) + "*"
+        statement = (
+            "SELECT kind, ref_id, title, content FROM search_index"
+            " WHERE search_index MATCH :query AND owner = :owner"
+            " ORDER BY bm25(search_index, 2.0, 1.0), ref_id DESC"
+            " LIMIT :limit OFFSET :offset"
+        )
+    rows = db.session.execute(text(statement), values).all()
+    results = [
+        {"kind": row[0], "id": int(row[1]), "title": row[2], "content": row[3]}
+        for row in rows[:page_size]
+    ]
+    return results, len(rows) > page_size
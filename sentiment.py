@@ -1,32 +1,134 @@
 """This file will handle our sentimental API"""
 import os
-import paralleldots
-from paralleldots import config
-from dotenv import find_dotenv, load_dotenv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from breaker import CircuitBreaker
+from metrics import timer, UPSTREAM_SECONDS
 
-load_dotenv(find_dotenv())
+# paralleldots (and numpy for the word list) take a while to import, so they
+# are loaded the first time an entry is scored instead of at start up
+_paralleldots = None
+_import_lock = threading.Lock()
 
-# set the key
-config.set_api_key(os.getenv("SENTIMENT_KEY"))
+# an emotion counts as a tone of the entry once its score is above this
+TONE_THRESHOLD = 0.25
+# how many texts go into one call to the batch emotion endpoint
+BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "20"))
+# where emotion scores come from: "remote" (paralleldots), "local" (the
+# offline word list) or "local-first" (word list, api for what it can't read)
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "remote")
+# seconds a request waits for one api call. The sdk sets no timeout of its
+# own, so the call runs in a pool thread and the request stops waiting.
+SENTIMENT_DEADLINE = float(os.getenv("SENTIMENT_DEADLINE", "5"))
+
+# calls that fail or miss the deadline open the circuit, then entries are
+# saved without tones at once and scored on a later view or by backfill-tones
+SENTIMENT_BREAKER = CircuitBreaker("paralleldots")
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sentiment")
+
+
+def sentiment_api():
+    """The paralleldots module with our key set, imported on first use"""
+    global _paralleldots  # pylint: disable=global-statement
+    with _import_lock:
+        if _paralleldots is None:
+            # pylint: disable=import-outside-toplevel
+            import paralleldots
+            from paralleldots import config
+
+            # set the key
+            config.set_api_key(os.getenv("SENTIMENT_KEY"))
+            _paralleldots = paralleldots
+    return _paralleldots
+
+
+def _within_deadline(func, *args):
+    # a late call keeps its pool thread until it returns, but the request
+    # raises TimeoutError and goes on without it
+    return _executor.submit(func, *args).result(timeout=SENTIMENT_DEADLINE)
 
-# get the emotion of the text
-def get_emotion(entry):
-    """This method will get the emotion for an individual journal entry"""
-    tones = []
-    emotions = paralleldots.emotion(entry)
 
-    # access data of each emotion
-    emotions = emotions["emotion"].items()
-    # print(emotions)
+def call_api(func, *args):
+    """Calls the sentiment api through its circuit, waiting at most
+    SENTIMENT_DEADLINE seconds"""
+    return SENTIMENT_BREAKER.call(_within_deadline, func, *args)
+
+
+def get_emotion_scores(text):
+    """Asks the sentiment api for the score of every emotion in text"""
+    api = sentiment_api()
+    with timer(UPSTREAM_SECONDS, "paralleldots"):
+        return call_api(api.emotion, text)["emotion"]
+
+
+def get_emotion_scores_batch(texts):
+    """Scores many texts with one batch api call per BATCH_SIZE texts and
+    returns the score dicts in the same order as texts"""
+    scores = []
+    for start in range(0, len(texts), BATCH_SIZE):
+        chunk = texts[start : start + BATCH_SIZE]
+        api = sentiment_api()
+        with timer(UPSTREAM_SECONDS, "paralleldots_batch"):
+            results = call_api(api.batch_emotion, chunk)["emotion"]
+        if len(results) != len(chunk):
+            raise ValueError(
+                f"Sentiment api scored {len(results)} of {len(chunk)} texts"
+            )
+        for result in results:
+            # some api versions nest each result the same way as the single call
+            scores.append(result.get("emotion", result))
+    return scores
+
+
+def get_local_scores(texts):
+    """Scores texts offline with the word list in emotion_lexicon"""
+    import emotion_lexicon  # pylint: disable=import-outside-toplevel
+
+    return emotion_lexicon.score_texts(texts)[0]
+
+
+def get_local_first_scores(texts):
+    """Scores texts offline and only sends the ones without a single known
+    word to the api. If the api is down the offline scores are kept."""
+    import emotion_lexicon  # pylint: disable=import-outside-toplevel
+
+    scores, matches = emotion_lexicon.score_texts(texts)
+    unknown = [index for index, count in enumerate(matches) if count == 0]
+    if unknown:
+        try:
+            remote = get_emotion_scores_batch([texts[index] for index in unknown])
+        except Exception:  # pylint: disable=broad-except
+            return scores
+        for index, remote_scores in zip(unknown, remote):
+            scores[index] = remote_scores
+    return scores
+
+
+# backend name -> function that turns a list of texts into score dicts
+BACKENDS = {
+    "remote": get_emotion_scores_batch,
+    "local": get_local_scores,
+    "local-first": get_local_first_scores,
+}
+
+
+def get_scores(texts, backend=None):
+    """Scores texts with the configured backend"""
+    return BACKENDS[backend or SENTIMENT_BACKEND](texts)
+
+
+def tones_from_scores(scores):
+    """Turns a dict of emotion scores into the tones we show for an entry"""
+    tones = []
 
     maximum = {"emotion": "None", "data": -1}  # hold highest emotion
-    for data in emotions:
+    for data in scores.items():
         # find maximum emotion value in case there is no value higher than 0.25
         if data[1] > maximum["data"]:
             maximum["emotion"] = data[0]
             maximum["data"] = data[1]
         # threshold for possible emotions conveyed
-        if data[1] > 0.25:
+        if data[1] > TONE_THRESHOLD:
             tones.append(data[0])
     # case to make sure a tone is shown
     if len(tones) == 0:
@@ -39,3 +141,32 @@ def get_emotion(entry):
     tones = [tone.replace("Fear", "Fearful") for tone in tones]
 
     return tones
+
+
+def analyze(text):
+    """Returns the raw emotion scores of text along with its tones, so both
+    can be stored with the entry"""
+    if SENTIMENT_BACKEND == "remote":
+        scores = get_emotion_scores(text)
+    else:
+        scores = get_scores([text])[0]
+    return scores, tones_from_scores(scores)
+
+
+def analyze_batch(texts):
+    """Same as analyze for many texts at once, returns (scores, tones) pairs
+    in the same order as texts"""
+    if not texts:
+        return []
+    return [(scores, tones_from_scores(scores)) for scores in get_scores(texts)]
+
+
+def get_emotions_batch(texts):
+    """Gets the tones of many journal entries with as few api calls as possible"""
+    return [tones for _scores, tones in analyze_batch(texts)]
+
+
+# get the emotion of the text
+def get_emotion(entry):
+    """This method will get the emotion for an individual journal entry"""
+    return analyze(entry)[1]
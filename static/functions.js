@@ -20,3 +20,118 @@ function toggleSettings() {
         localStorage.setItem("s", 'true');
     }
 }
+function useMyLocation() {
+    if (!navigator.geolocation) {
+        alert("Your browser can't share its location.");
+        return;
+    }
+    navigator.geolocation.getCurrentPosition(function (position) {
+        var form = new FormData();
+        form.append("lat", position.coords.latitude);
+        form.append("lon", position.coords.longitude);
+        fetch("/set_location", { method: "POST", body: form })
+            .then(function () {
+                // replace the weather the browser cached for the old location
+                return fetch("/widgets/weather_info", { cache: "reload" });
+            })
+            .then(function () {
+                window.location.reload();
+            });
+    });
+}
+function setTrendsRegion(woeid) {
+    var form = new FormData();
+    form.append("woeid", woeid);
+    fetch("/set_trends_region", { method: "POST", body: form })
+        .then(function () {
+            // replace the trends the browser cached for the old region
+            loadWidget("twitter_trends", { cache: "reload" });
+        });
+}
+
+// widget name -> [id of the widget box, key it is hidden under in localStorage]
+const WIDGETS = {
+    weather_info: ["weather_info", "w"],
+    fun_fact: ["fun_fact", "f"],
+    nyt: ["nyt_result", "n"],
+    twitter_trends: ["twitter", "t"],
+    nasa: ["nasa", "nasa"],
+};
+
+function addParagraph(parent, text, style) {
+    var paragraph = document.createElement("p");
+    paragraph.textContent = text;
+    if (style) {
+        paragraph.setAttribute("style", style);
+    }
+    parent.appendChild(paragraph);
+    return paragraph;
+}
+
+// how each widget turns its json into the page, text is never read as html
+const RENDERERS = {
+    weather_info: function (target, weather) {
+        addParagraph(target, weather.weather);
+        addParagraph(target, weather.fahrenheit, "font-size:25px; font-weight:bold;");
+        addParagraph(target, weather.city + ", " + weather.country);
+    },
+    fun_fact: function (target, fact) {
+        target.textContent = fact;
+    },
+    nyt: function (target, articles) {
+        articles.forEach(function (article) {
+            var item = document.createElement("div");
+            item.className = "list-group-item";
+            var title = document.createElement("h4");
+            title.textContent = article[0];
+            var link = document.createElement("a");
+            link.href = article[1];
+            link.textContent = "Read this article...";
+            item.appendChild(title);
+            item.appendChild(link);
+            target.appendChild(item);
+        });
+    },
+    twitter_trends: function (target, trends) {
+        trends.forEach(function (trend) {
+            addParagraph(target, trend);
+        });
+    },
+    nasa: function (target, nasa) {
+        var picture = document.getElementById("nasa_picture");
+        if (nasa.picture) {
+            picture.src = nasa.picture;
+            picture.style.display = "inline";
+        }
+        target.textContent = nasa.explanation;
+    },
+};
+
+function loadWidget(name, options) {
+    var target = document.querySelector('[data-widget="' + name + '"]');
+    fetch("/widgets/" + name, Object.assign({ credentials: "same-origin" }, options))
+        .then(function (response) {
+            return response.json();
+        })
+        .then(function (widget) {
+            target.textContent = "";
+            if (widget.data === null) {
+                target.textContent = "Unavailable right now.";
+                return;
+            }
+            RENDERERS[name](target, widget.data);
+        })
+        .catch(function () {
+            target.textContent = "Unavailable right now.";
+        });
+}
+
+// every widget loads on its own, so a slow one never holds up the others,
+// and widgets the user has hidden aren't loaded at all
+function loadWidgets() {
+    Object.keys(WIDGETS).forEach(function (name) {
+        if (localStorage.getItem(WIDGETS[name][1]) !== "true") {
+            loadWidget(name);
+        }
+    });
+}
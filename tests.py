@@ -1,12 +1,52 @@
 """In this file we will run all of our unit tests"""
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+from concurrent import futures
 from unittest.mock import MagicMock, patch
-from datetime import datetime
+from datetime import datetime, timedelta
+from flask import Flask, url_for
+from sqlalchemy import inspect, text
 from openweather import get_weather
 from nasa import nasa_picture
 from nyt import nyt_results
-from useful_functions import formation, sort_emotions
-from twitter import get_trends
+from useful_functions import formation, sort_emotions, date_range
+from twitter import get_trends, reset_client
+from widgets import fetch_widgets, trends_provider, weather_provider
+from cache import ProviderCache, widget_cache
+from scheduler import refresh_due
+from models import db, Entry, EntryTone, Joes, Task
+from database_functions import (
+    backfill_tones,
+    delete_entries,
+    delete_task_lists,
+    edit_task_lists,
+    reorder_task_lists,
+    get_entries_page,
+    get_task_lists,
+)
+from migrations import upgrade
+from search import create_search_index, index_row, search
+from assets import ASSET_MAX_AGE, init_assets
+from user_cache import CachedUser, get_user, user_cache
+from sentiment import get_emotions_batch, get_scores, tones_from_scores
+from benchmark import compare
+import metrics
+from breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN
+from journal_io import export_entries, import_entries, UnreadableFileError
+
+
+def make_test_app():
+    """Builds a throwaway app backed by an in-memory sqlite database"""
+    test_app = Flask(__name__)
+    test_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(test_app)
+    return test_app
+
 
 # testing the weather API response
 class WeatherTest(unittest.TestCase):
@@ -52,7 +92,7 @@ class WeatherTest(unittest.TestCase):
             "cod": 200,
         }
 
-        with patch("openweather.requests.get") as mock_requests_get:
+        with patch("openweather.http_client.get") as mock_requests_get:
             mock_requests_get.return_value = mock_response
 
             self.assertEqual(
@@ -162,8 +202,9 @@ class TwitterTests(unittest.TestCase):
 
         mock_response_auth.return_value = "92879e737e983748308748374987y489y8gf8wgef8ub"
 
-        with patch("twitter.tweepy.OAuthHandler") as mock_auth:
-            with patch("twitter.tweepy.API.get_place_trends") as mock_api:
+        reset_client()
+        with patch("tweepy.OAuthHandler") as mock_auth:
+            with patch("tweepy.API.get_place_trends") as mock_api:
                 mock_auth.return_value = mock_response_auth
 
                 mock_api.return_value = mock_reponse_api.return_value
@@ -172,6 +213,13 @@ class TwitterTests(unittest.TestCase):
                     get_trends(),
                     ["wardle", "McCarthy", "C-SPAN", "Marge", "Guy Lafleur"],
                 )
+                mock_api.assert_called_with(id=23424977)
+
+                # other regions reuse the same client
+                get_trends(23424975)
+                mock_api.assert_called_with(id=23424975)
+        self.assertEqual(mock_auth.call_count, 1)
+        reset_client()
 
 
 class NasaTests(unittest.TestCase):
@@ -185,13 +233,32 @@ class NasaTests(unittest.TestCase):
             "hdurl": "https://apod.nasa.gov/apod/image/2204/HaleBoppSeip_c4096.jpg",
             "explanation": "amazing explanation",
         }
-        with patch("nasa.requests.get") as mock_requests_get:
+        with patch("nasa.http_client.get") as mock_requests_get:
             mock_requests_get.return_value = mock_response_api
             self.assertEqual(
                 nasa_picture()["picture"],
                 "https://apod.nasa.gov/apod/image/2204/HaleBoppSeip_c4096.jpg",
             )
 
+    def test_nasa_video_day(self):
+        """On video days there is no hdurl, the thumbnail is shown instead"""
+        mock_response_api = MagicMock()
+        mock_response_api.json.return_value = {
+            "media_type": "video",
+            "url": "https://www.youtube.com/embed/abc",
+            "thumbnail_url": "https://img.youtube.com/vi/abc/0.jpg",
+            "explanation": "a video",
+        }
+        with patch("nasa.http_client.get") as mock_requests_get:
+            mock_requests_get.return_value = mock_response_api
+            self.assertEqual(
+                nasa_picture(),
+                {
+                    "picture": "https://img.youtube.com/vi/abc/0.jpg",
+                    "explanation": "a video",
+                },
+            )
+
 
 class NytTests(unittest.TestCase):
     """We'll test our NYT API and make sure we are retireving the data that's important to us"""
@@ -295,7 +362,7 @@ class NytTests(unittest.TestCase):
                 },
             ],
         }
-        with patch("nyt.requests.get") as mock_requests_get:
+        with patch("nyt.http_client.get") as mock_requests_get:
             mock_requests_get.return_value = mock_response_api
             self.assertEqual(
                 ([item[0] for item in nyt_results()]),
@@ -407,7 +474,7 @@ class NytTests(unittest.TestCase):
                 },
             ],
         }
-        with patch("nyt.requests.get") as mock_requests_get:
+        with patch("nyt.http_client.get") as mock_requests_get:
             mock_requests_get.return_value = mock_response_api
             self.assertEqual(
                 ([item[1] for item in nyt_results()]),
@@ -441,6 +508,21 @@ class AlgorithmsTests(unittest.TestCase):
         self.assertEqual(expected_entries, returned_entries)
         self.assertEqual(espected_tones, returned_tones)
 
+    def test_date_range(self):
+        """The ranges on the entries page should turn into the right datetimes"""
+        now = datetime(2022, 4, 15, 10, 30)  # a friday
+        self.assertEqual(date_range("week", now=now), (datetime(2022, 4, 11), None))
+        self.assertEqual(date_range("month", now=now), (datetime(2022, 4, 1), None))
+        self.assertEqual(
+            date_range("last_month", now=now),
+            (datetime(2022, 3, 1), datetime(2022, 4, 1)),
+        )
+        self.assertEqual(
+            date_range("custom", "2022-01-01", "2022-01-31", now=now),
+            (datetime(2022, 1, 1), datetime(2022, 2, 1)),
+        )
+        self.assertEqual(date_range("all", now=now), (None, None))
+
     def test_formatted_date(self):
         """This will make sure that the formatting of our dates remains correct"""
         date_object = datetime(
@@ -450,5 +532,961 @@ class AlgorithmsTests(unittest.TestCase):
         self.assertEqual(formation(date_object), expected_date)
 
 
+class WidgetsTests(unittest.TestCase):
+    """Testing that the home page widgets are fetched side by side"""
+
+    def test_widgets_run_concurrently(self):
+        """Three providers that each take 0.2s should finish together
+        instead of taking 0.6s one after another"""
+
+        def slow_provider():
+            time.sleep(0.2)
+            return "done"
+
+        providers = {"a": slow_provider, "b": slow_provider, "c": slow_provider}
+        start = time.monotonic()
+        widgets = fetch_widgets(providers, deadline=2)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(widgets, {"a": "done", "b": "done", "c": "done"})
+
+    def test_widgets_deadline_and_errors(self):
+        """A provider that is too slow or raises should come back as None
+        without holding up the others"""
+
+        def broken_provider():
+            raise KeyError("hdurl")
+
+        providers = {
+            "fast": lambda: "fast",
+            "slow": lambda: time.sleep(1) or "slow",
+            "broken": broken_provider,
+        }
+        start = time.monotonic()
+        widgets = fetch_widgets(providers, deadline=0.2)
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual(widgets, {"fast": "fast", "slow": None, "broken": None})
+
+    def test_widgets_fall_back_to_cache(self):
+        """A cached widget that misses the deadline while reloading should
+        come back with its last value instead of nothing"""
+        cache = ProviderCache(clock=lambda: 1000.0)
+        cache.put("slow", "yesterday", 0.0)
+        with patch("widgets.widget_cache", cache):
+            provider = cache.wrap("slow", lambda: time.sleep(1) or "today", 60)
+            widgets = fetch_widgets({"slow": provider}, deadline=0.1)
+        self.assertEqual(widgets, {"slow": "yesterday"})
+
+    def test_weather_shared_per_grid_cell(self):
+        """Users close to each other should share one weather fetch, users
+        further apart get their own"""
+        widget_cache.clear()
+        with patch("widgets.get_weather") as mock_weather:
+            mock_weather.side_effect = lambda lat, lon: {"city": f"{lat},{lon}"}
+            near = weather_provider(40.712, -74.006)()
+            nearby = weather_provider(40.738, -73.99)()
+            far = weather_provider(34.05, -118.24)()
+        self.assertEqual(near, nearby)
+        self.assertEqual(near, {"city": "40.7,-74.0"})
+        self.assertNotEqual(near, far)
+        self.assertEqual(mock_weather.call_count, 2)
+
+    def test_trends_shared_per_region(self):
+        """Users who picked the same region should share one trends fetch"""
+        widget_cache.clear()
+        with patch("widgets.get_trends") as mock_trends:
+            mock_trends.side_effect = lambda woeid: [f"trend in {woeid}"]
+            first = trends_provider(23424975)()
+            second = trends_provider(23424975)()
+            other = trends_provider(23424848)()
+        self.assertEqual(first, second)
+        self.assertEqual(other, ["trend in 23424848"])
+        self.assertEqual(mock_trends.call_count, 2)
+
+
+class CacheTests(unittest.TestCase):
+    """Testing the shared cache that sits in front of the widget providers"""
+
+    def test_single_flight(self):
+        """Many requests for a cold key should only trigger one upstream call"""
+        cache = ProviderCache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.1)
+            return "apod"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get("nasa", loader, ttl=60))
+            )
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["apod"] * 10)
+
+    def test_stale_while_revalidate(self):
+        """An expired value should be served right away while it refreshes"""
+        now = [1000.0]
+        cache = ProviderCache(clock=lambda: now[0])
+        refreshed = threading.Event()
+
+        def new_loader():
+            refreshed.set()
+            return "new"
+
+        cache.get("nyt", lambda: "old", ttl=60, max_stale=600)
+        now[0] += 120
+        self.assertEqual(cache.get("nyt", new_loader, ttl=60, max_stale=600), "old")
+        self.assertTrue(refreshed.wait(1))
+        time.sleep(0.05)
+        self.assertEqual(cache.get("nyt", new_loader, ttl=60, max_stale=600), "new")
+
+        # past the stale window the caller waits for a fresh value instead
+        now[0] += 1000
+        self.assertEqual(cache.get("nyt", lambda: "newest", ttl=60), "newest")
+
+    def test_invalidate(self):
+        """An invalidated key is loaded again, and a load that was running
+        when it was invalidated is not kept"""
+        cache = ProviderCache()
+        cache.get("user", lambda: "old", ttl=60)
+        cache.invalidate("user")
+        self.assertIsNone(cache.peek("user"))
+
+        def racing_loader():
+            cache.invalidate("user")
+            return "outdated"
+
+        self.assertEqual(cache.get("user", racing_loader, ttl=60), "outdated")
+        self.assertIsNone(cache.peek("user"))
+        self.assertEqual(cache.get("user", lambda: "new", ttl=60), "new")
+
+
+class UserCacheTests(unittest.TestCase):
+    """Testing the per process cache behind flask_login's user loader"""
+
+    def setUp(self):
+        self.app = make_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        user = Joes(email="a@b.c", username="bob", password="hash")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        user_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_second_load_skips_the_database(self):
+        """A user read once should come from memory the next time"""
+        self.assertEqual(get_user(str(self.user_id)).username, "bob")
+        with patch("user_cache.db.session.get") as mock_get:
+            user = get_user(str(self.user_id))
+        mock_get.assert_not_called()
+        self.assertEqual(user.username, "bob")
+        self.assertFalse(hasattr(user, "password"))
+
+    def test_update_invalidates(self):
+        """Saving a change to the user should be seen by the next load"""
+        self.assertIsNone(get_user(self.user_id).latitude)
+        db.session.get(Joes, self.user_id).latitude = 40.71
+        db.session.commit()
+        self.assertEqual(get_user(self.user_id).latitude, 40.71)
+
+    def test_read_between_flush_and_commit(self):
+        """A request reading the old row before the change is committed
+        should not keep it cached after the commit"""
+        get_user(self.user_id)
+        user = db.session.get(Joes, self.user_id)
+        old_row = CachedUser(user)
+        user.latitude = 40.71
+        db.session.flush()
+        # another request still sees the committed row until the commit
+        with patch("user_cache.db.session.get", return_value=old_row):
+            self.assertIsNone(get_user(self.user_id).latitude)
+        db.session.commit()
+        self.assertEqual(get_user(self.user_id).latitude, 40.71)
+
+    def test_unknown_user(self):
+        """A user id that does not exist should load as None"""
+        self.assertIsNone(get_user(self.user_id + 1))
+
+
+class SchedulerTests(unittest.TestCase):
+    """Testing the background refresh that keeps the widget snapshots warm"""
+
+    def test_one_worker_refreshes_others_read(self):
+        """Two worker processes share a snapshot folder, only the first one
+        should call the upstream and the second should read its result"""
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            return {"picture": "apod.jpg"}
+
+        policy = {"nasa": (60, 60)}
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            first, second = ProviderCache(), ProviderCache()
+            self.assertEqual(
+                refresh_due(first, {"nasa": upstream}, policy, snapshot_dir),
+                ["nasa"],
+            )
+            self.assertEqual(
+                refresh_due(second, {"nasa": upstream}, policy, snapshot_dir), []
+            )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.peek("nasa")[0], {"picture": "apod.jpg"})
+
+    def test_refreshes_before_expiry(self):
+        """A widget close to the end of its ttl should be fetched again"""
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            cache = ProviderCache()
+            cache.put("nyt", ["old"], time.time() - 55)
+            refresh_due(cache, {"nyt": lambda: ["new"]}, {"nyt": (60, 0)}, snapshot_dir)
+        self.assertEqual(cache.peek("nyt")[0], ["new"])
+
+
+class SentimentTests(unittest.TestCase):
+    """Testing how emotion scores are turned into tones"""
+
+    def test_tones_from_scores(self):
+        """Scores above 0.25 are tones, otherwise the highest one is used,
+        and Fear is shown as Fearful"""
+        self.assertEqual(
+            tones_from_scores({"Happy": 0.4, "Fear": 0.3, "Sad": 0.1}),
+            ["Happy", "Fearful"],
+        )
+        self.assertEqual(tones_from_scores({"Bored": 0.2, "Sad": 0.1}), ["Bored"])
+
+    def test_batch_emotions(self):
+        """Entries should be scored in chunks and mapped back in order"""
+        texts = [f"entry {number}" for number in range(45)]
+
+        def batch_emotion(chunk):
+            return {"emotion": [{"Happy": 0.1, "Sad": 0.9} for _ in chunk]}
+
+        # the api module itself is patched, importing it would set a key
+        with patch("sentiment.sentiment_api") as mock_api:
+            mock_batch = mock_api.return_value.batch_emotion
+            mock_batch.side_effect = batch_emotion
+            with patch("sentiment.BATCH_SIZE", 20):
+                tones = get_emotions_batch(texts)
+        self.assertEqual(mock_batch.call_count, 3)
+        self.assertEqual(tones, [["Sad"]] * 45)
+
+    def test_hung_api_is_not_waited_for(self):
+        """A call past the deadline should fail the request quickly, and
+        once the circuit opens the api should not be called at all"""
+        release = threading.Event()
+        with patch("sentiment.sentiment_api") as mock_api, patch(
+            "sentiment.SENTIMENT_DEADLINE", 0.05
+        ), patch("sentiment.SENTIMENT_BREAKER", CircuitBreaker("test", failures=2)):
+            mock_batch = mock_api.return_value.batch_emotion
+            mock_batch.side_effect = lambda chunk: release.wait(5)
+            for _ in range(2):
+                with self.assertRaises(futures.TimeoutError):
+                    get_emotions_batch(["a day"])
+            with self.assertRaises(CircuitOpenError):
+                get_emotions_batch(["a day"])
+        release.set()
+        self.assertEqual(mock_batch.call_count, 2)
+
+    def test_local_backend(self):
+        """The offline word list should give the same labels the entries page
+        filters on without calling the api"""
+        texts = [
+            "I am so happy and grateful today",
+            "Scared and anxious about the exam",
+            "I cried all night, so sad",
+            "Thrilled and excited for the trip",
+            "Went to work",
+        ]
+        with patch("sentiment.sentiment_api") as mock_api:
+            with patch("sentiment.SENTIMENT_BACKEND", "local"):
+                tones = get_emotions_batch(texts)
+        mock_api.assert_not_called()
+        self.assertEqual(
+            tones, [["Happy"], ["Fearful"], ["Sad"], ["Excited"], ["Bored"]]
+        )
+
+    def test_local_backend_one_word(self):
+        """A single matching word should not have Bored tagged along with it"""
+        with patch("sentiment.SENTIMENT_BACKEND", "local"):
+            tones = get_emotions_batch(["happy day", "so tired"])
+        self.assertEqual(tones, [["Happy"], ["Bored"]])
+
+    def test_local_first_backend(self):
+        """Only texts the word list knows nothing about should go to the api"""
+        with patch("sentiment.sentiment_api") as mock_api:
+            mock_batch = mock_api.return_value.batch_emotion
+            mock_batch.return_value = {"emotion": [{"Angry": 0.7, "Happy": 0.3}]}
+            scores = get_scores(["What a wonderful day", "Went to work"], "local-first")
+        mock_batch.assert_called_once_with(["Went to work"])
+        self.assertEqual(scores[1], {"Angry": 0.7, "Happy": 0.3})
+        self.assertGreater(scores[0]["Happy"], 0.5)
+
+
+class StoredTonesTests(unittest.TestCase):
+    """Testing that sentiment results are stored with the entries"""
+
+    def setUp(self):
+        self.app = make_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_upgrade_adds_columns(self):
+        """A database created before tones were stored should get the new columns"""
+        with db.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "CREATE TABLE entry (id INTEGER PRIMARY KEY, user INTEGER NOT NULL,"
+                    " title VARCHAR(50) NOT NULL, content VARCHAR(1500) NOT NULL,"
+                    " timestamp VARCHAR(100))"
+                )
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO entry (user, title, content, timestamp) VALUES"
+                    " (1, 'a', 'b', '4/15/2022'), (1, 'c', 'd', 'someday')"
+                )
+            )
+        upgrade()
+        self.assertIsNone(Entry.query.first().tones)
+        self.assertEqual(
+            [entry.timestamp for entry in Entry.query.order_by(Entry.id)],
+            [datetime(2022, 4, 15), None],
+        )
+
+    def test_upgraded_timestamps_in_date_range(self):
+        """Entries whose timestamps were migrated from text should be found by
+        a date range starting on the day they were written"""
+        with db.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "CREATE TABLE entry (id INTEGER PRIMARY KEY, user INTEGER NOT NULL,"
+                    " title VARCHAR(50) NOT NULL, content VARCHAR(1500) NOT NULL,"
+                    " timestamp VARCHAR(100))"
+                )
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO entry (user, title, content, timestamp) VALUES"
+                    " (1, 'a', 'b', '10/12/2022'), (1, 'c', 'd', '10/13/2022')"
+                )
+            )
+        upgrade()
+        entries, _newer, _older = get_entries_page(
+            1, 10, start=datetime(2022, 10, 12), end=datetime(2022, 10, 14)
+        )
+        self.assertEqual([entry.id for entry in entries], [2, 1])
+        entries, _newer, _older = get_entries_page(
+            1, 10, start=datetime(2022, 10, 12), end=datetime(2022, 10, 13)
+        )
+        self.assertEqual([entry.id for entry in entries], [1])
+
+    def test_upgrade_task_owner_to_user_id(self):
+        """Task lists stored by username should end up pointing at the user's
+        id, with the listing indexes in place"""
+        db.create_all()
+        db.session.add(Joes(id=7, email="a@b.c", username="sam", password="x"))
+        db.session.commit()
+        with db.engine.begin() as connection:
+            connection.execute(text("DROP TABLE task"))
+            connection.execute(
+                text(
+                    "CREATE TABLE task (id INTEGER PRIMARY KEY,"
+                    " user VARCHAR(100) NOT NULL, title VARCHAR(50) NOT NULL,"
+                    " content VARCHAR(1500) NOT NULL)"
+                )
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO task (id, user, title, content) VALUES"
+                    " (1, 'sam', 'a', 'b'), (2, '7', 'c', 'd'), (3, 'gone', 'e', 'f')"
+                )
+            )
+        upgrade()
+        self.assertEqual([task.id for task in get_task_lists(7)], [1, 2])
+        self.assertEqual(Task.query.count(), 2)
+        indexes = {index["name"] for index in inspect(db.engine).get_indexes("task")}
+        self.assertIn("ix_task_user_id", indexes)
+        indexes = {index["name"] for index in inspect(db.engine).get_indexes("entry")}
+        self.assertIn("ix_entry_user_id", indexes)
+
+    def test_backfill_tones(self):
+        """Entries without tones should be scored once, in batches"""
+        db.create_all()
+        for content in ["I am well", "What a day", "So tired"]:
+            db.session.add(Entry(user=1, title="t", content=content))
+        db.session.commit()
+        with patch("database_functions.analyze_batch") as mock_analyze:
+            mock_analyze.side_effect = lambda texts: [
+                ({"Happy": 0.6, "Sad": 0.1}, ["Happy"]) for _ in texts
+            ]
+            self.assertEqual(backfill_tones(batch_size=2), 3)
+            self.assertEqual(mock_analyze.call_count, 2)
+            self.assertEqual(backfill_tones(batch_size=2), 0)
+        self.assertEqual(
+            [entry.tone_list for entry in Entry.query.all()], [["Happy"]] * 3
+        )
+        self.assertEqual(EntryTone.query.filter_by(emotion="Happy").count(), 3)
+
+    def test_delete_removes_tones(self):
+        """Deleting an entry should delete its tones, so a new entry that
+        gets the same id can be scored"""
+        db.create_all()
+        create_search_index()
+        entry = Entry(user=1, title="t", content="c", tones="Happy")
+        entry.tone_rows = [EntryTone(emotion="Happy", user=1)]
+        db.session.add(entry)
+        db.session.commit()
+        delete_entries(1, [entry.id])
+        self.assertEqual(EntryTone.query.count(), 0)
+        entry = Entry(id=entry.id, user=1, title="t", content="c", tones="Happy")
+        entry.tone_rows = [EntryTone(emotion="Happy", user=1)]
+        db.session.add(entry)
+        db.session.commit()
+        self.assertEqual(EntryTone.query.count(), 1)
+
+
+class PaginationTests(unittest.TestCase):
+    """Testing that the journal is read one page at a time"""
+
+    def setUp(self):
+        self.app = make_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        for number in range(1, 26):
+            db.session.add(Entry(user=1, title="t", content=f"entry {number}"))
+        db.session.add(Entry(user=2, title="t", content="someone else"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_walk_pages(self):
+        """Following the older and newer cursors should visit every entry
+        once, newest first"""
+        entries, newer, older = get_entries_page(1, 10)
+        self.assertEqual([entry.id for entry in entries], list(range(25, 15, -1)))
+        self.assertEqual((newer, older), (None, 16))
+
+        entries, newer, older = get_entries_page(1, 10, before=16)
+        self.assertEqual([entry.id for entry in entries], list(range(15, 5, -1)))
+        self.assertEqual((newer, older), (15, 6))
+
+        entries, newer, older = get_entries_page(1, 10, before=6)
+        self.assertEqual([entry.id for entry in entries], list(range(5, 0, -1)))
+        self.assertEqual((newer, older), (5, None))
+
+        entries, newer, older = get_entries_page(1, 10, after=5)
+        self.assertEqual([entry.id for entry in entries], list(range(15, 5, -1)))
+        self.assertEqual((newer, older), (15, 6))
+
+        entries, newer, older = get_entries_page(1, 10, after=15)
+        self.assertEqual([entry.id for entry in entries], list(range(25, 15, -1)))
+        self.assertEqual((newer, older), (None, 16))
+
+    def test_filter_by_date(self):
+        """Only entries written inside the range should be returned"""
+        for entry in Entry.query.all():
+            entry.timestamp = datetime(2022, 1, 1) + timedelta(days=entry.id - 1)
+        db.session.commit()
+        entries, _newer, older = get_entries_page(
+            1, 5, start=datetime(2022, 1, 10), end=datetime(2022, 1, 20)
+        )
+        self.assertEqual([entry.id for entry in entries], [19, 18, 17, 16, 15])
+        entries, _newer, older = get_entries_page(
+            1, 5, before=older, start=datetime(2022, 1, 10), end=datetime(2022, 1, 20)
+        )
+        self.assertEqual([entry.id for entry in entries], [14, 13, 12, 11, 10])
+        self.assertIsNone(older)
+
+    def test_date_range_pages_by_time_written(self):
+        """Inside a date range the pages should follow when the entries were
+        written, even when that is not the order they were added in"""
+        for entry in Entry.query.all():
+            # added newest first, with a few written at the same moment
+            entry.timestamp = datetime(2022, 1, 1) + timedelta(
+                days=(30 - entry.id) // 2
+            )
+        db.session.commit()
+        dates = {"start": datetime(2022, 1, 1), "end": datetime(2022, 2, 1)}
+        entries, newer, older = get_entries_page(1, 10, **dates)
+        self.assertEqual(
+            [entry.id for entry in entries], [2, 1, 4, 3, 6, 5, 8, 7, 10, 9]
+        )
+        self.assertEqual((newer, older), (None, 9))
+        entries, newer, older = get_entries_page(1, 10, before=older, **dates)
+        self.assertEqual(
+            [entry.id for entry in entries], [12, 11, 14, 13, 16, 15, 18, 17, 20, 19]
+        )
+        self.assertEqual((newer, older), (12, 19))
+        entries, newer, older = get_entries_page(1, 10, after=newer, **dates)
+        self.assertEqual(
+            [entry.id for entry in entries], [2, 1, 4, 3, 6, 5, 8, 7, 10, 9]
+        )
+        self.assertEqual((newer, older), (None, 9))
+
+    def test_filter_by_emotion(self):
+        """Filtering by an emotion should only load the entries with that tone,
+        still one page at a time"""
+        for entry_id in range(1, 27):
+            emotion = "Happy" if entry_id % 3 == 0 else "Sad"
+            user = 2 if entry_id == 26 else 1
+            db.session.add(EntryTone(entry_id=entry_id, emotion=emotion, user=user))
+        db.session.add(EntryTone(entry_id=26, emotion="Happy", user=2))
+        db.session.commit()
+
+        entries, newer, older = get_entries_page(1, 5, emotion="Happy")
+        self.assertEqual([entry.id for entry in entries], [24, 21, 18, 15, 12])
+        self.assertEqual((newer, older), (None, 12))
+        entries, newer, older = get_entries_page(1, 5, before=12, emotion="Happy")
+        self.assertEqual([entry.id for entry in entries], [9, 6, 3])
+        self.assertEqual((newer, older), (9, None))
+
+
+class SearchTests(unittest.TestCase):
+    """Testing full-text search over entries and task lists"""
+
+    def setUp(self):
+        self.app = make_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        create_search_index()
+        rows = [
+            ("entry", Entry(user=1, title="Beach day", content="Swam in the ocean")),
+            (
+                "entry",
+                Entry(user=1, title="Work", content="Long day, thought of the beach"),
+            ),
+            ("task", Task(user=1, title="Packing", content="towel, beach umbrella")),
+            ("entry", Entry(user=2, title="Beach", content="someone else's beach")),
+        ]
+        for kind, row in rows:
+            db.session.add(row)
+            db.session.flush()
+            index_row(kind, row)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_ranked_results(self):
+        """Title matches should rank first and other users' rows never show"""
+        results, has_more = search(1, "beach")
+        self.assertEqual(results[0]["title"], "Beach day")
+        self.assertEqual(
+            sorted((result["kind"], result["id"]) for result in results),
+            [("entry", 1), ("entry", 2), ("task", 1)],
+        )
+        self.assertFalse(has_more)
+        results, has_more = search(1, "beach", page=1, page_size=2)
+        self.assertEqual((len(results), has_more), (2, True))
+        self.assertEqual(search(1, "umbrel")[0][0]["kind"], "task")
+        self.assertEqual(search(1, '"*:'), ([], False))
+
+    def test_index_follows_edits_and_deletes(self):
+        """Editing or deleting a row should update the index with it"""
+        delete_entries(1, [1])
+        edit_task_lists(1, {1: "sunscreen"})
+        self.assertEqual([result["id"] for result in search(1, "beach")[0]], [2])
+        self.assertEqual(search(1, "sunscreen")[0][0]["kind"], "task")
+
+
+class BatchMutationTests(unittest.TestCase):
+    """Testing that many entries and task lists change in one transaction"""
+
+    def setUp(self):
+        self.app = make_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        create_search_index()
+        for user in (1, 1, 1, 2):
+            entry = Entry(user=user, title="t", content="beach", tones="Happy")
+            entry.tone_rows = [EntryTone(emotion="Happy", user=user)]
+            task = Task(user=user, title="t", content="beach towel")
+            db.session.add_all([entry, task])
+            db.session.flush()
+            index_row("entry", entry)
+            index_row("task", task)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_delete_only_own_rows(self):
+        """Only the user's own entries and task lists should be deleted, with
+        their tones and search rows, in one commit"""
+        commit = db.session.commit
+        with patch(
+            "database_functions.db.session.commit", side_effect=commit
+        ) as commits:
+            self.assertEqual(delete_entries(1, [1, 2, 4, 99]), 2)
+        self.assertEqual(commits.call_count, 1)
+        self.assertEqual([entry.id for entry in Entry.query.order_by(Entry.id)], [3, 4])
+        self.assertEqual(EntryTone.query.count(), 2)
+        self.assertEqual(delete_task_lists(1, [3, 4]), 1)
+        self.assertEqual([task.id for task in get_task_lists(2)], [4])
+        self.assertEqual(
+            sorted((r["kind"], r["id"]) for r in search(1, "beach")[0]),
+            [("entry", 3), ("task", 1), ("task", 2)],
+        )
+        self.assertEqual(delete_entries(1, []), 0)
+
+    def test_edit_many(self):
+        """Task lists should be edited together and found by their new text"""
+        self.assertEqual(edit_task_lists(1, {1: "sunscreen", 2: "hat", 4: "x"}), 2)
+        self.assertEqual(
+            [task.content for task in get_task_lists(1)],
+            ["sunscreen", "hat", "beach towel"],
+        )
+        self.assertEqual(db.session.get(Task, 4).content, "beach towel")
+        self.assertEqual([r["id"] for r in search(1, "sunscreen")[0]], [1])
+
+    def test_reorder(self):
+        """Lists should come back in the order given, moved within the places
+        they had, and a new list should go last"""
+        self.assertEqual(reorder_task_lists(1, [3, 1, 3, 4]), [3, 1])
+        self.assertEqual([task.id for task in get_task_lists(1)], [3, 2, 1])
+        self.assertEqual(reorder_task_lists(1, [2, 3]), [2, 3])
+        self.assertEqual([task.id for task in get_task_lists(1)], [2, 3, 1])
+        db.session.add(Task(user=1, title="new", content="c"))
+        db.session.commit()
+        self.assertEqual([task.id for task in get_task_lists(1)], [2, 3, 1, 5])
+
+
+class JournalIOTests(unittest.TestCase):
+    """Testing the journal export and import, a batch at a time"""
+
+    def setUp(self):
+        self.app = make_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        create_search_index()
+        for day in range(1, 6):
+            entry = Entry(
+                user=1,
+                title=f"Day {day}",
+                content=f'line one\nline {day}, "quoted"',
+                timestamp=datetime(2022, 4, day, 9, 30),
+                tones="Happy,Sad",
+                emotion_scores='{"Happy": 0.6, "Sad": 0.3}',
+            )
+            entry.tone_rows = [
+                EntryTone(emotion="Happy", user=1),
+                EntryTone(emotion="Sad", user=1),
+            ]
+            db.session.add(entry)
+        db.session.add(Entry(user=2, title="Not mine", content="x"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_export_in_batches(self):
+        """Only the user's entries should be exported, oldest first, one
+        chunk per batch"""
+        chunks = list(export_entries(1, "jsonl", batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        lines = [json.loads(line) for line in "".join(chunks).splitlines()]
+        self.assertEqual(
+            [line["title"] for line in lines], [f"Day {d}" for d in range(1, 6)]
+        )
+        self.assertEqual(lines[0]["timestamp"], "2022-04-01T09:30:00")
+        self.assertEqual(lines[0]["emotion_scores"], {"Happy": 0.6, "Sad": 0.3})
+        self.assertEqual(
+            list(export_entries(3, "csv")),
+            ["id,title,content,timestamp,tones,emotion_scores\r\n"],
+        )
+
+    def test_round_trip(self):
+        """An export in either format should import into another journal as
+        the same entries and tones, committed a batch at a time"""
+        for file_format, user in (("jsonl", 3), ("csv", 4)):
+            exported = "".join(export_entries(1, file_format)).encode()
+            commit = db.session.commit
+            with patch("journal_io.db.session.commit", side_effect=commit) as commits:
+                imported, skipped = import_entries(
+                    user, io.BytesIO(exported), file_format, batch_size=2
+                )
+            self.assertEqual((imported, skipped), (5, 0))
+            self.assertEqual(commits.call_count, 3)
+            entries = Entry.query.filter_by(user=user).order_by(Entry.id).all()
+            self.assertEqual(
+                [(e.title, e.content, e.timestamp, e.tone_list) for e in entries],
+                [
+                    (
+                        f"Day {day}",
+                        f'line one\nline {day}, "quoted"',
+                        datetime(2022, 4, day, 9, 30),
+                        ["Happy", "Sad"],
+                    )
+                    for day in range(1, 6)
+                ],
+            )
+            self.assertEqual(EntryTone.query.filter_by(user=user).count(), 10)
+        self.assertEqual(len(search(3, "quoted", 1, 10)[0]), 5)
+
+    def test_import_skips_bad_records(self):
+        """Unreadable or invalid records should be skipped and the rest
+        scored and saved"""
+        upload = "\n".join(
+            [
+                '{"title": "Fine", "content": "a good day"}',
+                "not json",
+                '{"title": "", "content": "no title"}',
+                '{"title": "Too long", "content": "' + "x" * 1501 + '"}',
+                '{"title": "When", "content": "c", "timestamp": "yesterday"}',
+                "[1, 2]",
+            ]
+        )
+        with patch("database_functions.analyze_batch") as mock_analyze:
+            mock_analyze.side_effect = lambda texts: [
+                ({"Happy": 0.6}, ["Happy"]) for _ in texts
+            ]
+            imported, skipped = import_entries(5, io.BytesIO(upload.encode()), "jsonl")
+        self.assertEqual((imported, skipped), (1, 5))
+        self.assertEqual(Entry.query.filter_by(user=5).one().tone_list, ["Happy"])
+
+    def test_import_stops_at_unreadable_text(self):
+        """A file that stops being utf-8 should raise UnreadableFileError,
+        counting the batches saved before that"""
+        line = '{"title": "Fine", "content": "a good day", "tones": "Happy"}\n'
+        upload = io.BytesIO(line.encode() * 300 + b"\xff\xfe not utf-8\n")
+        with self.assertRaises(UnreadableFileError) as raised:
+            import_entries(5, upload, "jsonl", batch_size=50)
+        self.assertGreater(raised.exception.imported, 0)
+        self.assertEqual(
+            Entry.query.filter_by(user=5).count(), raised.exception.imported
+        )
+
+    def test_import_stops_at_oversized_csv_field(self):
+        """A csv field past the csv module's size limit should raise
+        UnreadableFileError instead of csv.Error"""
+        upload = "title,content\r\nFine,a good day\r\nHuge," + "x" * 200000
+        with patch("database_functions.analyze_batch") as mock_analyze:
+            mock_analyze.side_effect = lambda texts: [
+                ({"Happy": 0.6}, ["Happy"]) for _ in texts
+            ]
+            with self.assertRaises(UnreadableFileError) as raised:
+                import_entries(5, io.BytesIO(upload.encode()), "csv", batch_size=1)
+        self.assertEqual(raised.exception.imported, 1)
+        self.assertEqual(Entry.query.filter_by(user=5).count(), 1)
+
+
+class AssetsTests(unittest.TestCase):
+    """Testing the fingerprinted static files"""
+
+    def setUp(self):
+        self.static_dir = tempfile.TemporaryDirectory()
+        self.write("splash.png", b"png bytes")
+        self.write("style.css", b".content { background-image: url(splash.png); }")
+        self.app = Flask(
+            __name__, static_folder=self.static_dir.name, static_url_path="/static"
+        )
+        init_assets(self.app)
+
+    def tearDown(self):
+        self.static_dir.cleanup()
+
+    def write(self, name, body):
+        with open(os.path.join(self.static_dir.name, name), "wb") as target:
+            target.write(body)
+
+    def url(self, filename):
+        with self.app.test_request_context():
+            return url_for("static", filename=filename)
+
+    def test_hashed_url_is_cached_for_a_year(self):
+        """url_for should hand out a hashed name that is immutable"""
+        url = self.url("splash.png")
+        self.assertRegex(url, r"^/static/splash\.[0-9a-f]{12}\.png$")
+        response = self.app.test_client().get(url)
+        self.assertEqual(response.data, b"png bytes")
+        self.assertEqual(response.cache_control.max_age, ASSET_MAX_AGE)
+        self.assertTrue(response.cache_control.immutable)
+
+    def test_plain_and_stale_names_are_revalidated(self):
+        """Old hashes and unhashed names still work but must not be kept"""
+        old_url = self.url("splash.png")
+        self.write("splash.png", b"new png bytes")
+        self.assertNotEqual(self.url("splash.png"), old_url)
+        client = self.app.test_client()
+        for url in (old_url, "/static/splash.png"):
+            response = client.get(url)
+            self.assertEqual(response.data, b"new png bytes")
+            self.assertTrue(response.cache_control.no_cache)
+            self.assertFalse(response.cache_control.immutable)
+
+    def test_css_points_at_hashed_images(self):
+        """The stylesheet should link the image by its hashed name and get a
+        new hash of its own when the image changes"""
+        client = self.app.test_client()
+        css_url = self.url("style.css")
+        body = client.get(css_url).get_data(as_text=True)
+        self.assertIn(self.url("splash.png").rsplit("/", 1)[1], body)
+        self.write("splash.png", b"new png bytes")
+        self.assertNotEqual(self.url("style.css"), css_url)
+
+
+class BenchmarkTests(unittest.TestCase):
+    """Testing that the benchmark compare mode catches regressions"""
+
+    def test_compare_flags_regressions(self):
+        """Only paths slower than the threshold should fail, and paths the
+        baseline does not know about are left out"""
+        baseline = {"fast": {"best": 1.0}, "slow": {"best": 1.0}}
+        results = {
+            "fast": {"best": 1.2},
+            "slow": {"best": 1.3},
+            "new": {"best": 5.0},
+        }
+        rows, regressions = compare(baseline, results, 0.25)
+        self.assertEqual([row[0] for row in rows], ["fast", "slow"])
+        self.assertEqual(regressions, ["slow"])
+
+
+class BreakerTests(unittest.TestCase):
+    """Testing that a failing upstream is left alone for a while"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(
+            "nasa", failures=2, reset=30, slow=4, clock=lambda: self.now
+        )
+
+    def _failing_call(self):
+        raise KeyError("hdurl")
+
+    def test_opens_after_failures(self):
+        """After enough failures in a row calls should fail without being made"""
+        for _ in range(2):
+            with self.assertRaises(KeyError):
+                self.breaker.call(self._failing_call)
+        self.assertEqual(self.breaker.state, OPEN)
+        upstream = MagicMock()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(upstream)
+        upstream.assert_not_called()
+
+    def test_probe_closes_or_reopens(self):
+        """Once the reset time is up one probe goes through, a working probe
+        closes the circuit and a failing one opens it again"""
+        for _ in range(2):
+            with self.assertRaises(KeyError):
+                self.breaker.call(self._failing_call)
+        self.now = 31
+        with self.assertRaises(KeyError):
+            self.breaker.call(self._failing_call)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: "ok")
+        self.now = 62
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_slow_calls_count_as_failures(self):
+        """A call slower than the limit should count as failed, but still
+        return its result"""
+
+        def slow():
+            self.now += 5
+            return "late"
+
+        self.assertEqual(self.breaker.call(slow), "late")
+        self.assertEqual(self.breaker.call(slow), "late")
+        self.assertEqual(self.breaker.state, OPEN)
+
+
+class MetricsTests(unittest.TestCase):
+    """Testing the latency histograms shown on /metrics"""
+
+    def setUp(self):
+        for histogram in metrics.REGISTRY.values():
+            histogram.reset()
+
+    def test_requests_timed_by_route(self):
+        """A request should be counted under its route pattern and status"""
+        test_app = Flask(__name__)
+        metrics.init_metrics(test_app)
+        test_app.add_url_rule("/things/<int:thing>", "thing", lambda thing: "ok")
+        client = test_app.test_client()
+        client.get("/things/1")
+        client.get("/things/2")
+        client.get("/nothing")
+        text_format = metrics.render(metrics.collect())
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",'
+            'route="/things/<int:thing>",status="200"} 2',
+            text_format,
+        )
+        self.assertIn('route="<unmatched>",status="404"', text_format)
+        self.assertIn(
+            'http_request_duration_seconds_bucket{method="GET",'
+            'route="/things/<int:thing>",status="200",le="+Inf"} 2',
+            text_format,
+        )
+
+    def test_upstream_errors_counted(self):
+        """A failing upstream call should be timed with an error outcome"""
+
+        @metrics.timed(metrics.UPSTREAM_SECONDS, "nasa")
+        def broken():
+            raise KeyError("hdurl")
+
+        with self.assertRaises(KeyError):
+            broken()
+        totals = metrics.collect()[metrics.UPSTREAM_SECONDS.name]
+        self.assertEqual(list(totals), [("nasa", "error")])
+        self.assertEqual(sum(totals[("nasa", "error")][:-1]), 1)
+
+    def test_workers_added_up(self):
+        """/metrics should add the numbers every worker wrote to METRICS_DIR"""
+        with tempfile.TemporaryDirectory() as folder, patch.dict(
+            os.environ, {"METRICS_DIR": folder}
+        ):
+            metrics.QUERY_SECONDS.observe(0.002, "get_entries", "ok")
+            metrics.flush()
+            # another worker's file, as flush would have written it
+            with open(os.path.join(folder, "1.json"), "w", encoding="utf-8") as file:
+                json.dump(metrics.snapshot(), file)
+            metrics.QUERY_SECONDS.observe(3.0, "get_entries", "ok")
+            values = metrics.collect()[metrics.QUERY_SECONDS.name][
+                ("get_entries", "ok")
+            ]
+        # this process's two calls taken live, the other worker's one from its file
+        self.assertEqual(sum(values[:-1]), 3)
+        self.assertEqual(values[0], 2)
+        self.assertAlmostEqual(values[-1], 3.004)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,24 +1,65 @@
 """Twitter API"""
 import os
-import tweepy
-from dotenv import find_dotenv, load_dotenv
+import threading
+import http_client
+from metrics import timed, UPSTREAM_SECONDS
 
-load_dotenv(find_dotenv())
+# WOEID of the United States, shown to users who haven't picked a region
+DEFAULT_WOEID = 23424977
 
+# regions a user can pick trends from, name -> WOEID. Kept to a short list
+# so every region is one shared cached value instead of one per user.
+TREND_REGIONS = {
+    "Worldwide": 1,
+    "United States": 23424977,
+    "Canada": 23424775,
+    "Mexico": 23424900,
+    "Brazil": 23424768,
+    "United Kingdom": 23424975,
+    "Germany": 23424829,
+    "France": 23424819,
+    "India": 23424848,
+    "Japan": 23424856,
+    "Australia": 23424748,
+    "Atlanta": 2357024,
+    "New York": 2459115,
+    "Los Angeles": 2442047,
+}
 
-def get_trends():
-    """Gets top trending tags from twitter"""
-    # assign the values accordingly
-    consumer_key = os.getenv("TWITTER_KEY")
-    consumer_secret = os.getenv("TWITTER_SECRET")
-    # authorization of consumer key and consumer secret
-    auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
+_client = None
+_client_lock = threading.Lock()
 
-    # WOEID of the United States
-    woeid = 23424977
 
-    # getting authorization for our keys, then finding the trending topics
-    trends = tweepy.API(auth).get_place_trends(id=woeid)
+def get_client():
+    """The twitter api client, built once per process and shared by every
+    region, since it holds nothing that changes between calls"""
+    global _client  # pylint: disable=global-statement
+    with _client_lock:
+        if _client is None:
+            # tweepy is slow to import and only needed here, so it is loaded on first use
+            import tweepy  # pylint: disable=import-outside-toplevel
+
+            # authorization of consumer key and consumer secret
+            auth = tweepy.OAuthHandler(
+                os.getenv("TWITTER_KEY"), os.getenv("TWITTER_SECRET")
+            )
+            _client = tweepy.API(auth, timeout=http_client.READ_TIMEOUT)
+        return _client
+
+
+def reset_client():
+    """Forgets the client, e.g. after the keys change, so the next call
+    builds a new one"""
+    global _client  # pylint: disable=global-statement
+    with _client_lock:
+        _client = None
+
+
+@timed(UPSTREAM_SECONDS, "twitter")
+def get_trends(woeid=DEFAULT_WOEID):
+    """Gets top trending tags from twitter for the region with this WOEID"""
+    # finding the trending topics with the shared client
+    trends = get_client().get_place_trends(id=woeid)
     trends = trends[0]["trends"]
 
     # This will find the top 5 trending topics
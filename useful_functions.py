@@ -1,5 +1,16 @@
 """file to properly format our dates"""
 
+from datetime import datetime, timedelta
+
+# date ranges the entries page can be narrowed to
+DATE_RANGES = {
+    "all": "All time",
+    "week": "This week",
+    "month": "This month",
+    "last_month": "Last month",
+    "custom": "Custom range",
+}
+
 
 def formation(date):
     """Here will take the dateTime String, and format it in a way
@@ -8,6 +19,32 @@ def formation(date):
     return fulldate
 
 
+def date_range(name, start=None, end=None, now=None):
+    """Turns a range picked on the entries page into (start, end) datetimes,
+    start inclusive and end exclusive. Either one is None when the range is
+    open on that side. start/end are "YYYY-MM-DD" strings for a custom range."""
+    now = now or datetime.now()
+    today = datetime(now.year, now.month, now.day)
+    first_of_month = today.replace(day=1)
+    if name == "week":
+        return today - timedelta(days=today.weekday()), None
+    if name == "month":
+        return first_of_month, None
+    if name == "last_month":
+        return (first_of_month - timedelta(days=1)).replace(day=1), first_of_month
+    if name == "custom":
+        try:
+            start = datetime.strptime(start, "%Y-%m-%d") if start else None
+            # the end day itself is part of the range
+            end = (
+                datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1) if end else None
+            )
+        except ValueError:
+            return None, None
+        return start, end
+    return None, None
+
+
 def sort_emotions(entries, sort_key, tones):
     """This method will filter out all the entries that don't have the emotion
     we are looking for, the emotion will be held in the variable called sort_key"""
@@ -0,0 +1,70 @@
+"""Keeps the signed in users of this process in memory, so a page view does
+not have to read the joes table before it can do any real work"""
+
+import os
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from cache import ProviderCache
+from models import db, Joes
+
+# seconds a cached user is trusted. Changes made through this process are
+# seen right away; other worker processes see them within this time.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+
+class CachedUser(UserMixin):
+    """The parts of a Joes row the pages use, kept apart from any database
+    session so it can be shared between requests. The password hash is
+    deliberately left out."""
+
+    FIELDS = ("id", "email", "username", "latitude", "longitude", "trends_woeid")
+
+    def __init__(self, user):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(user, field))
+
+    def __repr__(self):
+        return "Username %r" % self.username
+
+
+# one cache per process shared by every request
+user_cache = ProviderCache()
+
+
+def _load(user_id):
+    user = db.session.get(Joes, user_id)
+    return CachedUser(user) if user is not None else None
+
+
+def get_user(user_id):
+    """The user with user_id, from memory when it was read recently"""
+    user_id = int(user_id)
+    return user_cache.get(user_id, lambda: _load(user_id), USER_CACHE_TTL)
+
+
+def invalidate_user(user_id):
+    """Makes the next get_user in this process read the user again"""
+    user_cache.invalidate(int(user_id))
+
+
+@event.listens_for(Joes, "after_update")
+@event.listens_for(Joes, "after_delete")
+def _remember_changed_user(_mapper, _connection, target):
+    # any change made through the orm, e.g. a new location or password. It
+    # is only forgotten once committed, forgetting it at the flush would let
+    # another request cache the old row again before the commit.
+    object_session(target).info.setdefault("changed_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_changed_users(session):
+    if session.in_nested_transaction():
+        # a savepoint, the outer transaction can still roll it back
+        return
+    # users of a transaction that was rolled back stay in the set, which
+    # only costs them one extra read after the next commit
+    for user_id in session.info.pop("changed_users", ()):
+        invalidate_user(user_id)
@@ -0,0 +1,127 @@
+"""Fetches the home page widgets side by side instead of one after another"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+from openweather import get_weather, weather_cell
+from fun_fact import fun_fact
+from nyt import nyt_results
+from twitter import get_trends, DEFAULT_WOEID
+from nasa import nasa_picture
+from cache import widget_cache
+from breaker import CircuitBreaker
+
+# how many provider calls may run at once and how long a widget is waited for
+WIDGET_WORKERS = int(os.getenv("WIDGET_WORKERS", "8"))
+WIDGET_DEADLINE = float(os.getenv("WIDGET_DEADLINE", "4"))
+# seconds a browser may reuse a widget it already loaded
+WIDGET_MAX_AGE = int(os.getenv("WIDGET_MAX_AGE", "60"))
+
+# these widgets show the same data to every user, so they are read through
+# the shared cache: (seconds a value stays fresh, extra seconds it may be
+# served stale while it refreshes)
+MINUTE = 60
+HOUR = 60 * MINUTE
+CACHE_POLICY = {
+    "weather_info": (5 * MINUTE, 30 * MINUTE),
+    "fun_fact": (24 * HOUR, 24 * HOUR),
+    "nyt": (HOUR, 6 * HOUR),
+    "twitter_trends": (15 * MINUTE, HOUR),
+    "nasa": (24 * HOUR, 24 * HOUR),
+}
+
+# weather for a user's own location, cached per grid cell
+LOCAL_WEATHER_POLICY = (10 * MINUTE, 20 * MINUTE)
+
+# one circuit per upstream api, shared by every region or grid cell of it.
+# A call that takes longer than a page waits for counts as failed.
+BREAKERS = {
+    name: CircuitBreaker(name, slow=WIDGET_DEADLINE)
+    for name in ["weather_info", "fun_fact", "nyt", "twitter_trends", "nasa"]
+}
+
+# template variable name -> function that calls the upstream api, through
+# its circuit so a failing api is left alone for a while
+UPSTREAMS = {
+    "weather_info": partial(BREAKERS["weather_info"].call, get_weather),
+    "fun_fact": partial(BREAKERS["fun_fact"].call, fun_fact),
+    "nyt": partial(BREAKERS["nyt"].call, nyt_results),
+    "twitter_trends": partial(BREAKERS["twitter_trends"].call, get_trends),
+    "nasa": partial(BREAKERS["nasa"].call, nasa_picture),
+}
+
+# what /home actually calls: the upstream itself, or a cached read of it
+PROVIDERS = {
+    name: (
+        widget_cache.wrap(name, upstream, *CACHE_POLICY[name])
+        if name in CACHE_POLICY
+        else upstream
+    )
+    for name, upstream in UPSTREAMS.items()
+}
+
+
+def weather_provider(lat, lon):
+    """The weather widget for a user's location. Users in the same grid cell
+    share one cached value, so upstream calls grow with the number of places
+    rather than the number of users."""
+    if lat is None or lon is None:
+        return PROVIDERS["weather_info"]
+    cell = weather_cell(lat, lon)
+    return widget_cache.wrap(
+        f"weather_info:{cell[0]}:{cell[1]}",
+        partial(BREAKERS["weather_info"].call, get_weather, *cell),
+        *LOCAL_WEATHER_POLICY,
+    )
+
+
+def trends_provider(woeid):
+    """The twitter widget for a user's region. There is one cached value per
+    region, however many users picked it."""
+    if woeid is None or woeid == DEFAULT_WOEID:
+        return PROVIDERS["twitter_trends"]
+    return widget_cache.wrap(
+        f"twitter_trends:{woeid}",
+        partial(BREAKERS["twitter_trends"].call, get_trends, woeid),
+        *CACHE_POLICY["twitter_trends"],
+    )
+
+
+def user_providers(user):
+    """The widget providers for one user's home page"""
+    return dict(
+        PROVIDERS,
+        weather_info=weather_provider(user.latitude, user.longitude),
+        twitter_trends=trends_provider(user.trends_woeid),
+    )
+
+
+_executor = ThreadPoolExecutor(max_workers=WIDGET_WORKERS, thread_name_prefix="widget")
+
+
+def fetch_widgets(providers=None, deadline=None):
+    """Runs every provider in the shared pool and waits at most `deadline`
+    seconds for all of them, the budget of the whole request. A provider
+    that fails, misses the deadline or whose circuit is open comes back with
+    the last value it had in the cache however old, or None when it never
+    had one, so the page can still render without it."""
+    if providers is None:
+        providers = PROVIDERS
+    if deadline is None:
+        deadline = WIDGET_DEADLINE
+    futures = {name: _executor.submit(provider) for name, provider in providers.items()}
+    wait(futures.values(), timeout=deadline)
+
+    widgets = {}
+    for name, future in futures.items():
+        if future.done() and future.exception() is None:
+            widgets[name] = future.result()
+        else:
+            # a late provider keeps its pool thread until it returns,
+            # but this request no longer waits on it
+            future.cancel()
+            # e.g. the first load after a long outage, still under way
+            cached = widget_cache.peek(getattr(providers[name], "cache_key", None))
+            widgets[name] = None if cached is None else cached[0]
+    return widgets